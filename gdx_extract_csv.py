@@ -11,58 +11,57 @@ import os.path
 import optparse
 import string
 import csv
+import multiprocessing
+import heapq
 
 
 #- Errors ----------------------------------------------------------------------
 
 class extract_error(Exception):
      def __init__(self, msg):
+         # Pass msg on so that errors can be pickled back from read_file
+         Exception.__init__(self, msg)
          self.msg = msg
 
 
 #- Replace a parameter with the contents of a csv file -------------------------
 
-def write_value(v, header, values, address_map, address):
-    if not address:
-        if type(v) == str:
-            address = (v, )
-            v = True
+def format_value(v):
+    if type(v) == float:
+        return "%.16g" % v
+    elif type(v) == bool:
+        if v == True:
+            return "YES"
         else:
-            address = ("", )
-    a = ".".join(address)
-    if not a in values:
-        values[a] = {}
-    values[a][header] = v
-    address_map[a] = address
-
-
-def write_parameter(s, header, values, address_map, descriptions, stype="notset", address=None):
-    if isinstance(s, gdxdict.gdxdim):
-        for k in s:
-            if address:
-                a2 = address + (k, )
-            else:
-                a2 = (k, )
-            if "description" in s.getinfo(k):
-                a3 = ".".join(a2)
-                if not a3 in descriptions:
-                    descriptions[a3] = {}
-                descriptions[a3][header] = s.getinfo(k)["description"]
-            write_parameter(s[k], header, values, address_map, descriptions, stype, a2)
+            return "NO"
     else:
-        if stype == "set": s = True
-        write_value(s, header, values, address_map, address)
+        return v
+
+
+def symbol_records(symbols, symbol_name, umap):
+    # The records of a symbol with their keys translated to another universal
+    # set by umap.  If that changes the order of the keys, the records have to
+    # be sorted.
+    if symbols.getinfo(symbol_name)["dims"] == 0:
+        return [((), symbols[symbol_name], None)]
+    records = symbols.records(symbol_name)
+    if umap == None: return records
+    records = ((tuple([umap[k] for k in keys]), v, d) for keys, v, d in records)
+    for i in range(1, len(umap)):
+        if umap[i] < umap[i-1]: return sorted(records)
+    return records
+
+
+def tag_records(records, column):
+    for keys, v, description in records:
+        yield keys, column, v, description
 
 
 def write_report(filesymbols, symbols1, domains, symbol_names, output=None):
     if not output: output = sys.stdout
 
-    # Generate all the lines for the report
-    header_map = {}
-    values = {}
-    address_map = {}
-    descriptions = {}
-
+    # Find a column for each symbol in each file
+    columns = {}
     for f in filesymbols:
         symbols = filesymbols[f]
         for sn in symbol_names:
@@ -72,29 +71,24 @@ def write_report(filesymbols, symbols1, domains, symbol_names, output=None):
                     header = n + ": " + sn
                 else:
                     header = sn
-                header_map[header] = True
-                s = symbols[sn]
-                typename = symbols.getinfo(sn)["typename"]
-                if typename == "Set":
-                    write_parameter(s, header, values, address_map, descriptions, "set")
-                else:
-                    write_parameter(s, header, values, address_map, descriptions)
-
-    uel_dict = symbols1.universal
-    rows = []
-    for r in values:
-        names = address_map[r]
-        nums = ()
-        for n in names:
-            if n != "":
-                nums = nums + (uel_dict[n.lower()],)
-            nums = nums + (1,)
-        rows.append((nums, r, address_map[r]))
-    rows.sort()
+                columns[header] = (symbols, sn)
     headers = []
-    for h in header_map: headers.append(h)
+    for h in columns: headers.append(h)
     headers.sort()
 
+    # Every symbol's records come out in its file's universal set order.  Map
+    # their keys onto symbols1's universal set (which has all the files' UELs
+    # merged into it) and merge the streams of records, so that rows are
+    # written as soon as we've seen their keys in all the streams, without
+    # holding on to the records or sorting them.
+    streams = []
+    for c in range(len(headers)):
+        symbols, sn = columns[headers[c]]
+        umap = None
+        if not symbols is symbols1:
+            umap = [symbols1.universal[k.lower()] for k in symbols.order]
+        streams.append(tag_records(symbol_records(symbols, sn, umap), c))
+
     is_one_d_set = True if (len(headers) == 1 and len(domains) == 1) else False
 
     csvout = csv.writer(output)
@@ -102,42 +96,79 @@ def write_report(filesymbols, symbols1, domains, symbol_names, output=None):
     csvrow = []
     for d in domains: csvrow.append("(" + d + ")")
     csvrow += headers
-    if len(headers) == 1 and symbols1.getinfo(headers[0])["description"]:
-        csvrow.append("!" + symbols1.getinfo(headers[0])["description"])
+    if len(headers) == 1:
+        symbols, sn = columns[headers[0]]
+        if symbols.getinfo(sn)["description"]:
+            csvrow.append("!" + symbols.getinfo(sn)["description"])
     csvout.writerow(csvrow)
 
-    for r in rows:
-        csvrow = []
-        name = r[1]
-        if name != "":
-            csvrow += r[2]
-        for h in headers:
-            if name in values and h in values[name]:
-                v = values[name][h]
-                if type(v) == float:
-                    csvrow.append("%.16g" % v)
-                elif type(v) == bool:
-                    if v == True:
-                        csvrow.append("YES")
-                    else:
-                        csvrow.append("NO")
-                else:
-                    csvrow.append(v)
-            else:
-                csvrow.append("NO")
-        if is_one_d_set and name in descriptions and h in descriptions[name]:
-            csvrow.append(descriptions[name][h])
+    order = symbols1.order
+    def write_row(keys, values, description):
+        csvrow = [order[k] for k in keys]
+        csvrow += values
+        if is_one_d_set and description != None:
+            csvrow.append(description)
         csvout.writerow(csvrow)
 
+    row_keys = None
+    for keys, c, v, description in heapq.merge(*streams):
+        if keys != row_keys:
+            if row_keys != None: write_row(row_keys, row_values, row_description)
+            row_keys = keys
+            row_values = ["NO"] * len(headers)
+        row_values[c] = format_value(v)
+        row_description = description
+    if row_keys != None: write_row(row_keys, row_values, row_description)
+
+
+def read_file(args):
+    # Read one file for read_files_separately in a worker process.  Symbols
+    # are read as gdxcolumns, which are quicker to pickle back to the parent.
+    # If symbol_names is given, only those symbols are read.
+    filename, gams_dir, symbol_names, cache = args
+    try:
+        G = gdxdict.gdxdict()
+        if symbol_names:
+            G.read(filename, gams_dir, lazy=True, columnar=True, cache=cache)
+            for sn in symbol_names:
+                if sn in G: G.load(sn)
+            G.discard_pending()
+        else:
+            G.read(filename, gams_dir, columnar=True, cache=cache)
+        return G
+    except gdxx.GDX_error, err:
+        raise extract_error("%s: %s" % (filename, err.msg))
+    except gdxdict.gdxdict_error, err:
+        raise extract_error("%s: %s" % (filename, err.msg))
+
 
-def read_files_separately(files, gams_dir=None):
+def read_files_separately(files, gams_dir=None, lazy=False, jobs=1, symbol_names=None, cache=False):
     filesymbols = {}
     symbols1 = None
 
+    if jobs > 1 and len(files) > 1:
+        # Read the files in a pool of processes.  imap gives us the results
+        # in the order of files, so the UELs are merged in the same order as
+        # they would be if we read the files one after the other.
+        if not lazy: symbol_names = None
+        pool = multiprocessing.Pool(min(jobs, len(files)))
+        try:
+            results = pool.imap(read_file, [(f, gams_dir, symbol_names, cache) for f in files])
+            for f in files:
+                G = results.next()
+                filesymbols[f] = G
+                if not symbols1:
+                    symbols1 = G
+                else:
+                    symbols1.merge_UELs(G)
+        finally:
+            pool.terminate()
+        return filesymbols, symbols1
+
     # Read all the symbols from all the files
     for f in files:
         G = gdxdict.gdxdict()
-        G.read(f, gams_dir)
+        G.read(f, gams_dir, lazy=lazy, cache=cache)
         filesymbols[f] = G
         if not symbols1:
             symbols1 = G
@@ -147,7 +178,7 @@ def read_files_separately(files, gams_dir=None):
     return filesymbols, symbols1
 
 
-def read_files_combined(files, gams_dir=None):
+def read_files_combined(files, gams_dir=None, lazy=False, cache=False):
     filesymbols = {}
     symbols1 = None
 
@@ -155,7 +186,7 @@ def read_files_combined(files, gams_dir=None):
 
     # Read all the symbols from all the files
     for f in files:
-        G.read(f, gams_dir)
+        G.read(f, gams_dir, lazy=lazy, cache=cache)
         if not symbols1:
             symbols1 = G
             filesymbols[f] = G
@@ -164,6 +195,17 @@ def read_files_combined(files, gams_dir=None):
 
 
 def write_symbol_report(symbols, filesymbols, symbol_names, output=None):
+    # If the files were read lazily, guess the domains of symbols over * now,
+    # before we look at them.  That only reads their keys: their records are
+    # streamed from the files when we write the report.
+    for f in filesymbols:
+        for sn in symbol_names:
+            if not sn in filesymbols[f]: continue
+            for d in filesymbols[f].getinfo(sn)["domain"]:
+                if d["key"] == "*":
+                    filesymbols[f].guess_symbol_domains(sn)
+                    break
+
     # Check the domains of all the symbols
     potential_domains = []
     for sn in symbol_names:
@@ -220,13 +262,13 @@ def write_domain_report(symbols, filesymbols, domains, output=None):
 
     # Find all the symbols that have the specified domains
     for f in filesymbols:
-        symbols = filesymbols[f]
+        fsymbols = filesymbols[f]
         remove = []
         for k in possible_symbols:
-            if not k in symbols:
+            if not k in fsymbols:
                 remove.append(k)
                 continue
-            info = symbols.getinfo(k)
+            info = fsymbols.getinfo(k)
             if info["dims"] != len(domains):
                 remove.append(k)
                 continue
@@ -248,7 +290,27 @@ def write_domain_report(symbols, filesymbols, domains, output=None):
     write_report(filesymbols, symbols, domains, symbol_names, output)
 
 
-def write_all_reports(symbols, filesymbols, output):
+# What write_symbol_file works on.  It's set before the pool of processes is
+# forked, so the workers share the parent's copy of the symbols.
+all_reports = None
+
+def write_symbol_file(s):
+    symbols, filesymbols, output = all_reports
+    # Guess the domains of a symbol over * before writing its header
+    info = symbols.getinfo(s)
+    for d in info["domain"]:
+        if d["key"] == "*":
+            symbols.guess_symbol_domains(s)
+            break
+    domains = []
+    for d in info["domain"]:
+        domains.append(d["key"])
+    write_report(filesymbols, symbols, domains, [s], open(output+s+".csv", "wb"))
+
+
+def write_all_reports(symbols, filesymbols, output, jobs=1):
+    global all_reports
+
     try: os.makedirs(os.path.dirname(output))
     except:
         pass
@@ -259,13 +321,30 @@ def write_all_reports(symbols, filesymbols, output):
         universal_file.write(s + "\n")
     universal_file.close()
 
-    # Find all the symbols that have the specified domains
-    for s in symbols:
-        info = symbols.getinfo(s)
-        domains = []
-        for d in info["domain"]:
-            domains.append(d["key"])
-        write_report(filesymbols, symbols, domains, [s], open(output+s+".csv", "wb"))
+    all_reports = (symbols, filesymbols, output)
+    symbol_names = list(symbols)
+
+    # Symbols that haven't been loaded are streamed from the file: close it
+    # so that each process opens its own handle
+    symbols.close()
+
+    # Write a file for every symbol.  Each file only depends on its symbol,
+    # so they can be written in any order by a pool of processes.  Sharing
+    # the symbols with the workers relies on fork, so Windows gets one
+    # process.
+    if jobs > 1 and len(symbol_names) > 1 and hasattr(os, "fork"):
+        pool = multiprocessing.Pool(min(jobs, len(symbol_names)))
+        try:
+            for r in pool.imap_unordered(write_symbol_file, symbol_names):
+                pass
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for s in symbol_names:
+            write_symbol_file(s)
+    all_reports = None
 
 
 #- main ------------------------------------------------------------------------
@@ -303,6 +382,8 @@ Denmark, 70032, 124781
     parser.add_option("-a", "--all", help="Write all symbols.  When you choose --all, you must specify an output file *prefix* with -o.  Each symbol in the gdx file will be written as a csv file named <prefix><symbol_name>.csv.  If prefix is a directory name (ie 'dir\\' on windows or 'dir/' on *nix), then any intermediate directories will be created", action="store_true")
     parser.add_option("-o", "--output", help="Where to write the output csv file (default is to the console), or the output file prefix if --all is used", default=None)
     parser.add_option("-g", "--gams-dir", help="Specify the GAMS installation directory if it isn't found automatically", default=None)
+    parser.add_option("-C", "--cache", help="Keep what's read from each gdx file in a <file>.cache file next to it, and read from that while the gdx file is unchanged", action="store_true")
+    parser.add_option("-j", "--jobs", help="Use up to JOBS processes: when comparing files, read several files at once, and with --all, write several symbols at once", type="int", default=1)
 
     try:
         options, args = parser.parse_args(argv)
@@ -345,13 +426,17 @@ Denmark, 70032, 124781
         else:
             outfile = sys.stdout
 
+        # If we're only reporting on a few named symbols, only read those,
+        # and with --all, stream each symbol from the file as it's written
+        lazy = (options.symbols and not options.domains) or options.all
+
         if options.compare:
-            filesymbols, symbols = read_files_separately(files, options.gams_dir)
+            filesymbols, symbols = read_files_separately(files, options.gams_dir, lazy, options.jobs, options.symbols, options.cache)
         else:
-            filesymbols, symbols = read_files_combined(files, options.gams_dir)
+            filesymbols, symbols = read_files_combined(files, options.gams_dir, lazy, options.cache)
 
         if options.all:
-            write_all_reports(symbols, filesymbols, outfile)
+            write_all_reports(symbols, filesymbols, outfile, options.jobs)
         elif options.domains:
             write_domain_report(symbols, filesymbols, options.domains, outfile)
         else:
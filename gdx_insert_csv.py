@@ -8,23 +8,28 @@ import gdxdict
 import sys
 import os
 import csv
+import array
 import optparse
+import multiprocessing
 
 
 #- Errors ----------------------------------------------------------------------
 
 class csv_error(Exception):
      def __init__(self, msg):
+         Exception.__init__(self, msg)
          self.msg = msg
 
 
 #- Replace a parameter with the contents of a csv file -------------------------
 
-def insert_symbol(symbols, input_csv, stage):
+def read_header(input_csv):
+    # Read the header of a csv file, and work out which stage it should be
+    # inserted in.  Returns None if the file is empty.
     reader = csv.reader(open(input_csv))
 
     try: header = reader.next()
-    except: return
+    except: return None
 
     domains = []
     symbol_names = []
@@ -38,17 +43,150 @@ def insert_symbol(symbols, input_csv, stage):
         else:
             symbol_names.append(c)
 
-    if stage == 1:
-        if len(domains) > 0: return # or domains[0] != "*": return
-    elif stage == 2:
-        if len(domains) != 1 or domains[0] != "*": return
-    elif stage == 3:
-        if len(domains) != 1 or domains[0] == "*": return
+    # Symbols have to go in after their domains, so scalars go first, then
+    # sets over *, then other 1-D symbols, and then everything else
+    if len(domains) == 0:
+        stage = 1
+    elif len(domains) == 1 and domains[0] == "*":
+        stage = 2
+    elif len(domains) == 1:
+        stage = 3
     else:
-        if len(domains) <= 1: return
+        stage = 4
+
+    return {
+      "filename": input_csv,
+      "domains": domains,
+      "symbol_names": symbol_names,
+      "description": description,
+      "stage": stage,
+    }
+
+
+def plan_inserts(input_csvs):
+    # Read every header once and put the files in the order they need to be
+    # inserted in
+    stages = [[], [], [], []]
+    for c in input_csvs:
+        header = read_header(c)
+        if header: stages[header["stage"]-1].append(header)
+    plan = []
+    for s in stages: plan += s
+    return plan
+
+
+def read_column(input_csv, name, cells):
+    # Work out whether a column is all numbers or all YESes and NOs, and turn
+    # it into an array of doubles or an array of 1s and 0s.  Returns the type
+    # of the symbol and the array.
+    try:
+        return "Parameter", array.array("d", map(float, cells))
+    except ValueError:
+        pass
+
+    flags = array.array("b")
+    for c in cells:
+        v = c.strip().upper()
+        if v == "YES":
+            flags.append(1)
+        elif v == "NO":
+            flags.append(0)
+        else:
+            try:
+                float(v)
+                raise csv_error("%s: column '%s' mixes numbers and YES/NO" % (input_csv, name))
+            except ValueError:
+                raise csv_error("%s: '%s' in column '%s' isn't a number or YES/NO" % (input_csv, c, name))
+    return "Set", flags
+
+
+def parse_csv(header):
+    # Read the body of a csv file into columns that are cheap to send back
+    # from a worker process: a list of keys for each dimension, and for each
+    # symbol, its type and an array of its values.  If some rows are too short
+    # to have a value for a symbol, "present" says which rows the symbol's
+    # values came from.  Row descriptions are kept in a dict by row.
+    input_csv = header["filename"]
+    dims = len(header["domains"])
+    symbol_names = header["symbol_names"]
+    width = dims + len(symbol_names)
+
+    reader = csv.reader(open(input_csv))
+    reader.next()
+
+    keys = [[] for d in range(dims)]
+    cells = [[] for n in symbol_names]
+    present = {}
+    descriptions = {}
+    count = 0
+    for row in reader:
+        if len(row) < dims: continue
+        for d in range(dims):
+            keys[d].append(row[d].strip())
+        for i in range(len(symbol_names)):
+            if dims + i < len(row):
+                if i in present: present[i].append(count)
+                cells[i].append(row[dims+i])
+            elif not i in present:
+                present[i] = array.array("i", range(len(cells[i])))
+        if len(row) > width:
+            row_description = row[-1].strip()
+            if row_description: descriptions[count] = row_description
+        count += 1
+
+    columns = []
+    for i in range(len(symbol_names)):
+        columns.append(read_column(input_csv, symbol_names[i], cells[i]))
+
+    return {
+      "count": count,
+      "keys": keys,
+      "columns": columns,
+      "present": present,
+      "descriptions": descriptions,
+    }
+
+
+def insert_column(symbols, name, keys, column, rows, descriptions):
+    # Insert a whole column of values into a symbol in one batch.  rows says
+    # which rows of the file the values came from if some rows were too short
+    # to have one.  Only set records keep their descriptions, because they're
+    # the only ones that get written.  A scalar's description comes from its
+    # row.
+    typename, values = column
+    if len(values) == 0: return
+    symbols.set_type(name, typename)
+    is_set = typename == "Set"
+    if rows == None: rows = range(len(values))
+
+    dims = len(keys)
+    if dims == 0:
+        for j in range(len(values)):
+            if not is_set: symbols[name] = values[j]
+            elif values[j]: symbols[name] = True
+            if rows[j] in descriptions:
+                symbols.setinfo(name)["description"] = descriptions[rows[j]]
+        return
+
+    if len(rows) < len(keys[0]):
+        keys = [[k[p] for p in rows] for k in keys]
+    texts = None
+    if is_set and descriptions:
+        texts = [descriptions.get(p) for p in rows]
+    symbols.add_records(name, keys, values, texts=texts, columns=True)
+
+
+def insert_csv(symbols, header, block=None):
+    input_csv = header["filename"]
+    domains = header["domains"]
+    symbol_names = header["symbol_names"]
+    description = header["description"]
 
     print "Reading from", input_csv
 
+    if block == None: block = parse_csv(header)
+    keys = block["keys"]
+
     for d in domains:
         if d != "*":
             info = {}
@@ -66,50 +204,16 @@ def insert_symbol(symbols, input_csv, stage):
             info["domain"].append({"key": d})
         symbols.add_symbol(info)
 
-    for row in reader:
-        keys = row[0:len(domains)]
-        for j in range(len(keys)):
-            k = keys[j].strip()
-            symbols.add_key(k)
-            if domains[j] != "*":
-                if not k in symbols[domains[j]]:
-                    symbols[domains[j]][k] = True
-
-        values = row[len(domains):len(domains)+len(symbol_names)]
-        if len(row) > len(domains) + len(symbol_names):
-            row_description = row[-1].strip()
-        else:
-            row_description = None
-        for i in range(len(values)):
-            name = symbol_names[i].strip()
-            value = values[i].strip().upper()
-            symbol = symbols[name]
-            for j in range(len(keys)-1):
-                k = keys[j].strip()
-                if not k in symbol:
-                    symbol[k] = gdxdict.gdxdim(symbols)
-                symbol = symbol[k]
-
-            if len(keys) == 0:
-                symbol = symbols
-                k = name
-            else:
-                k = keys[-1].strip()
-
-            if value == "YES" or value == "NO":
-                if value == "YES":
-                    symbol[k] = True
-                else:
-                    if k in symbol: del symbol[k]
-                symbols.set_type(name, "Set")
-            else:
-                symbol[k] = float(value)
-                symbols.set_type(name, "Parameter")
-
-            if row_description:
-                symbol.setinfo(k)["description"] = row_description
-
+    # Add all the keys at once, in the order they appear in the file, and
+    # then add them to their domains
+    symbols.add_keys(keys)
+    for d in range(len(domains)):
+        if domains[d] != "*":
+            symbols.add_records(domains[d], [keys[d]], columns=True)
 
+    for i in range(len(symbol_names)):
+        insert_column(symbols, symbol_names[i].strip(), keys, block["columns"][i],
+            block["present"].get(i), block["descriptions"])
 
     for n in symbol_names:
         name = n.strip()
@@ -120,18 +224,37 @@ def insert_symbol(symbols, input_csv, stage):
         symbols.setinfo(symbol_names[0])["description"] = description
 
 
-def insert_symbols(input_csvs, input_gdx=None, output_gdx=None, gams_dir=None):
+def insert_symbols(input_csvs, input_gdx=None, output_gdx=None, gams_dir=None, jobs=1):
     if output_gdx == None: output_gdx = input_gdx
 
-    symbols = gdxdict.gdxdict()
-    if input_gdx:
-        symbols.read(input_gdx, gams_dir)
+    plan = plan_inserts(input_csvs)
+
+    # With more than one job, the csv files are parsed in a pool of
+    # processes while we read the GDX file.  imap hands the columns back in plan
+    # order, so the symbols and UELs are inserted in the same order as they
+    # would be if we parsed the files ourselves.
+    pool = None
+    if jobs > 1 and len(plan) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(plan)))
+        results = pool.imap(parse_csv, plan)
 
-    for i in range(1,5):
-        for c in input_csvs:
-            insert_symbol(symbols, c, i)
+    try:
+        # Read the input lazily: only the symbols the csv files touch get
+        # loaded, and write copies the rest straight across from the input
+        symbols = gdxdict.gdxdict()
+        if input_gdx:
+            symbols.read(input_gdx, gams_dir, lazy=True)
+
+        for header in plan:
+            if pool:
+                insert_csv(symbols, header, results.next())
+            else:
+                insert_csv(symbols, header)
+    finally:
+        if pool: pool.terminate()
 
     symbols.write(output_gdx, gams_dir)
+    symbols.discard_pending()
 
 
 #- main ------------------------------------------------------------------------
@@ -148,6 +271,7 @@ Insert data in a csv file into a gdx file.
     parser.add_option("-o", "--output", help="Where to write the output file (defaults to overwriting input)", default=None)
     parser.add_option("-d", "--directory", help="Directory from which to read csv files", action="append", dest="directories")
     parser.add_option("-g", "--gams-dir", help="Specify the GAMS installation directory if it isn't found automatically", default=None)
+    parser.add_option("-j", "--jobs", help="Parse up to JOBS csv files at once", type="int", default=1)
 
     try:
         options, args = parser.parse_args(argv)
@@ -166,7 +290,7 @@ Insert data in a csv file into a gdx file.
                     if f.endswith(".csv"):
                         input_csvs.append(os.path.join(d, f))
 
-        insert_symbols(input_csvs, input_gdx, output_gdx, options.gams_dir)
+        insert_symbols(input_csvs, input_gdx, output_gdx, options.gams_dir, options.jobs)
 
     except (optparse.OptionError, TypeError), err:
         print >>sys.stderr, err
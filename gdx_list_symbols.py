@@ -11,10 +11,21 @@ import optparse
 
 #- List symbols in a gdx file --------------------------------------------------
 
-def list_symbols(files, gams_dir=None):
+def list_symbols(files, gams_dir=None, guess_domains=False):
     G = gdxdict.gdxdict()
-    for f in files:
-        G.read(f, gams_dir)
+    if guess_domains:
+        for f in files:
+            G.read(f, gams_dir, lazy=True)
+        # Only the symbols we don't know the domain of need to be read
+        for k in list(G):
+            for d in G.getinfo(k)["domain"]:
+                if d["key"] == "*":
+                    G.load(k)
+                    break
+        G.close()
+    else:
+        for f in files:
+            G.read_info(f, gams_dir)
 
     for k in G:
         info = G.getinfo(k)
@@ -46,6 +57,7 @@ Set isweekend(days)
 Parameter daynumber(days)
 """)
     parser.add_option("-g", "--gams-dir", help="Specify the GAMS installation directory if it isn't found automatically", default=None)
+    parser.add_option("-d", "--guess-domains", help="Guess the domains of symbols whose domains aren't in the GDX file (this means reading their records)", action="store_true", default=False)
 
     try:
         options, args = parser.parse_args(argv)
@@ -57,7 +69,7 @@ Parameter daynumber(days)
             if not args[i].lower().endswith(".gdx"):
                 args[i] += ".gdx"
 
-        list_symbols(args[1:], options.gams_dir)
+        list_symbols(args[1:], options.gams_dir, options.guess_domains)
 
     except (optparse.OptionError, TypeError), err:
         print >>sys.stderr, err
@@ -11,14 +11,24 @@ import optparse
 
 #- Merge two gdx files ---------------------------------------------------------
 
-def merge_gdx(input_gdxes, output_gdx=None, gams_dir=None):
-    if output_gdx == None: output_gdx = input_gdxes[1]
+def merge_gdx(input_gdxes, output_gdx=None, gams_dir=None, stream=False):
+    if output_gdx == None: output_gdx = input_gdxes[0]
 
     G = gdxdict.gdxdict()
-    for f in input_gdxes:
-        G.read(f, gams_dir)
 
+    if not stream:
+        for f in input_gdxes:
+            G.read(f, gams_dir)
+        G.write(output_gdx, gams_dir)
+        return
+
+    # Only read the universal sets and symbol tables (which checks that the
+    # symbols in the files are compatible), and then let write copy the
+    # symbols across one at a time, merging the records from all the files.
+    for f in input_gdxes:
+        G.read(f, gams_dir, lazy=True)
     G.write(output_gdx, gams_dir)
+    G.discard_pending()
 
 
 #- main ------------------------------------------------------------------------
@@ -30,6 +40,7 @@ def main(argv=None):
     parser = optparse.OptionParser(usage = "%prog [options] <input gdx 1> <input gdx 2> ...")
     parser.add_option("-g", "--gams-dir", help="Specify the GAMS installation directory", default=None)
     parser.add_option("-o", "--output", help="Where to write the output file (defaults to input gdx 1)", default=None)
+    parser.add_option("-s", "--stream", help="Copy one symbol at a time from the input files to the output, rather than reading all of the input files into memory first.  Domains that aren't in the input files are still guessed, from each symbol's keys, as it is copied", action="store_true", default=False)
 
     try:
         options, args = parser.parse_args(argv)
@@ -42,13 +53,13 @@ def main(argv=None):
         if not output_gdx:
             output_gdx = input_gdxes[0]
 
-        for i in range(input_gdxes):
+        for i in range(len(input_gdxes)):
             if not input_gdxes[i].lower().endswith(".gdx"):
                 input_gdxes[i] += ".gdx"
 
         print "Reading from %s and writing to '%s'" % (input_gdxes, output_gdx)
         
-        merge_gdx(input_gdxes, output_gdx, options.gams_dir)
+        merge_gdx(input_gdxes, output_gdx, options.gams_dir, options.stream)
 
     except (optparse.OptionError, TypeError), err:
         print >>sys.stderr, err
@@ -4,7 +4,14 @@
 import gdxcc
 import gdxx
 import sys
+import os
 import string
+import array
+import heapq
+import mmap
+import struct
+import json
+import itertools
 
 
 #- Errors ----------------------------------------------------------------------
@@ -31,6 +38,17 @@ def get_type_code(typename):
     return type_codes[string.lower(typename)]
 
 
+def field_count(typename):
+    # How many values each record of a symbol has: sets only have their
+    # descriptions, and variables and equations have a value for every level
+    if typename == "Set":
+        return 0
+    elif typename == "Variable" or typename == "Equation":
+        return len(level_names)
+    else:
+        return 1
+
+
 GMS_SV_PINF = 3e300
 GMS_SV_MINF = 4e300
 
@@ -49,36 +67,258 @@ default_variable_fields = [
 ]
 
 
+#- Record information ----------------------------------------------------------
+
+# The extra information a record can have: the description of a set element,
+# or the level, marginal, bounds and scale of a variable or equation, which are
+# kept as an array of doubles in level_names order.  A NaN in limits means
+# the record uses the default for its variable type.
+# A gdxinfo can also be used like the dict it replaces, with "description" and
+# "limits" keys, where limits is a gdxlimits, which looks like
+# { ".l": level, ".m": marginal... } and writes changes back into the array.
+# Anything else stored in a gdxinfo goes in a dict of its own.
+
+no_limit = float("nan")
+
+def limits_array(limits):
+    if isinstance(limits, array.array): return limits
+    a = array.array("d")
+    for n in level_names:
+        a.append(limits.get(n, no_limit))
+    return a
+
+
+class dictlike(object):
+    # The rest of a dict's methods, for classes with keys, __getitem__,
+    # __setitem__ and __delitem__
+    __slots__ = ()
+
+    def get(self, k, default=None):
+        if k in self: return self[k]
+        return default
+
+    def setdefault(self, k, default=None):
+        if not k in self: self[k] = default
+        return self[k]
+
+    def pop(self, k, *default):
+        if not k in self:
+            if default: return default[0]
+            raise KeyError(k)
+        v = self[k]
+        del self[k]
+        return v
+
+    def has_key(self, k):
+        return k in self
+
+    def __contains__(self, k):
+        return k in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def update(self, other):
+        for k in other.keys(): self[k] = other[k]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        try:
+            return dict(self.items()) == dict(other.items())
+        except AttributeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class gdxlimits(dictlike):
+    # A record's limits as a dict keyed by level_names.  It reads and writes
+    # the gdxinfo's array, so setinfo(k)["limits"][".lo"] = 0 works as it did
+    # when limits were dicts.
+    __slots__ = ("info",)
+
+    def __init__(self, info):
+        self.info = info
+
+    def field(self, k):
+        if not k in level_names: raise KeyError(k)
+        return level_names.index(k)
+
+    def __getitem__(self, k):
+        v = no_limit
+        if self.info.limits != None: v = self.info.limits[self.field(k)]
+        if v != v: raise KeyError(k)
+        return v
+
+    def __setitem__(self, k, v):
+        f = self.field(k)
+        if self.info.limits == None:
+            self.info.limits = array.array("d", [no_limit]) * len(level_names)
+        self.info.limits[f] = v
+
+    def __delitem__(self, k):
+        self[k]
+        self.info.limits[self.field(k)] = no_limit
+
+    def keys(self):
+        limits = self.info.limits
+        if limits == None: return []
+        return [level_names[i] for i in range(len(level_names)) if limits[i] == limits[i]]
+
+
+class gdxinfo(dictlike):
+    __slots__ = ("description", "limits", "extra")
+
+    def __init__(self):
+        self.description = None
+        self.limits = None
+        self.extra = None
+
+    def __getstate__(self):
+        return (self.description, self.limits, self.extra)
+
+    def __setstate__(self, state):
+        self.description, self.limits, self.extra = state
+
+    def __getitem__(self, ikey):
+        if ikey == "description":
+            if self.description != None: return self.description
+        elif ikey == "limits":
+            if self.limits != None: return gdxlimits(self)
+        elif self.extra != None and ikey in self.extra:
+            return self.extra[ikey]
+        raise KeyError(ikey)
+
+    def __setitem__(self, ikey, value):
+        if ikey == "description":
+            self.description = value
+        elif ikey == "limits":
+            self.limits = limits_array(value)
+        else:
+            if self.extra == None: self.extra = {}
+            self.extra[ikey] = value
+
+    def __delitem__(self, ikey):
+        self[ikey]
+        if ikey == "description":
+            self.description = None
+        elif ikey == "limits":
+            self.limits = None
+        else:
+            del self.extra[ikey]
+
+    def keys(self):
+        keys = []
+        if self.description != None: keys.append("description")
+        if self.limits != None: keys.append("limits")
+        if self.extra != None: keys += self.extra.keys()
+        return keys
+
+
+def limit(limits, i, defaults):
+    # Field i of a record's limits, or the default if it isn't set
+    if limits != None:
+        v = limits[i]
+        if v == v: return v
+    return defaults[i]
+
+
 #- One dimension of a gdxdict --------------------------------------------------
 
-class gdxdim:
+# items and info are keyed by the index of each key in the parent's universal
+# set, so keys are only case-folded once, when the gdxdict first sees them,
+# and iterating over a dimension only has to sort its own keys.  Those indexes
+# mean nothing to another gdxdict, so a gdxdim (or any other storage) from
+# one gdxdict is copied with its keys mapped when it's put in another (see
+# gdxdict.adopt).
+
+class gdxdim(object):
+    # info is only created for a dimension that has records with information
+    __slots__ = ("parent", "items", "info")
 
     def __init__(self, parent):
         self.parent = parent
         self.items = {}
-        self.info = {}
+        self.info = None
+
+    def __getstate__(self):
+        return (self.parent, self.items, self.info)
+
+    def __setstate__(self, state):
+        self.parent, self.items, self.info = state
+
+    def index(self, key):
+        i = self.parent.key_index(key)
+        if i == None: raise KeyError(key)
+        return i
 
     def __setitem__(self, key, value):
-        self.items[key.lower()] = value
-        self.parent.add_key(key)
+        if isinstance(value, gdxdim) and not value.parent is self.parent:
+            value = self.parent.adopt(value)
+        self.items[self.parent.add_key(key)] = value
 
     def __getitem__(self, key):
-        return self.items[key.lower()]
+        return self.items[self.index(key)]
+
+    def __delitem__(self, key):
+        i = self.index(key)
+        del self.items[i]
+        if self.info and i in self.info: del self.info[i]
 
     def __iter__(self):
-        for k in self.parent.order:
-            if k.lower() in self.items: yield k
+        order = self.parent.order
+        for i in sorted(self.items): yield order[i]
 
     def __contains__(self, key):
-        return key.lower() in self.items
+        i = self.parent.key_index(key)
+        return i != None and i in self.items
+
+    def find_info(self, i):
+        # The gdxinfo for a key index, or None
+        if self.info: return self.info.get(i)
+        return None
+
+    def record_info(self, i):
+        # The gdxinfo for a key index, created if it doesn't exist
+        if self.info == None: self.info = {}
+        ri = self.info.get(i)
+        if ri == None:
+            ri = self.info[i] = gdxinfo()
+        return ri
 
     def getinfo(self, key, ikey=None):
-        kl = key.lower()
-        if kl in self.info:
+        i = self.parent.key_index(key)
+        ri = None
+        if i != None: ri = self.find_info(i)
+        if ri != None:
             if ikey:
-                return self.info[kl][ikey]
+                return ri[ikey]
             else:
-                return self.info[kl]
+                return ri
         else:
             if ikey:
                 return None
@@ -86,35 +326,310 @@ class gdxdim:
                 return {}
 
     def setinfo(self, key, ikey=None, value=None):
-        kl = key.lower()
-        if not kl in self.info:
-            self.info[kl] = {}
+        ri = self.record_info(self.index(key))
         if ikey:
-            self.info[kl][ikey] = value
+            ri[ikey] = value
         else:
-            return self.info[kl]
+            return ri
+
+
+#- A symbol stored as columns ---------------------------------------------------
+
+# Rather than a tree of gdxdims, a symbol can be stored as one array of indexes
+# into the gdxdict's universal set for each dimension, and one array of doubles
+# for each of the symbol's levels.  Set descriptions are stored as indexes into
+# a list of the symbol's distinct descriptions.
+# gdxdict.__getitem__ turns the columns back into gdxdims when a symbol is
+# used like a dictionary.
+
+class gdxcolumns:
+
+    def __init__(self, parent, dims, typename):
+        self.parent = parent
+        self.typename = typename
+        self.keys = []
+        for d in range(dims):
+            self.keys.append(array.array("i"))
+        self.values = []
+        for i in range(field_count(typename)):
+            self.values.append(array.array("d"))
+        self.text = array.array("i")
+        self.texts = [None]
+        self.text_index = {}
+        # False if records might be out of order or repeated
+        self.ordered = True
+
+    def __getstate__(self):
+        # Pickle the arrays as strings rather than lists of numbers
+        state = self.__dict__.copy()
+        state["keys"] = [k.tostring() for k in self.keys]
+        state["values"] = [v.tostring() for v in self.values]
+        state["text"] = self.text.tostring()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.keys = [array.array("i", k) for k in state["keys"]]
+        self.values = [array.array("d", v) for v in state["values"]]
+        self.text = array.array("i", state["text"])
+
+    def __len__(self):
+        if len(self.keys) > 0:
+            return len(self.keys[0])
+        return 0
+
+    def add_text(self, description):
+        if description == None: return 0
+        if not description in self.text_index:
+            self.text_index[description] = len(self.texts)
+            self.texts.append(description)
+        return self.text_index[description]
+
+    def sort(self):
+        # Put the records in universal set order, and if the same record
+        # appears more than once, keep the last one
+        if self.ordered: return
+        keys = self.keys
+        def record_key(p):
+            return tuple([k[p] for k in keys])
+        order = range(len(self))
+        order.sort(key=record_key)
+        keep = []
+        for i in range(len(order)):
+            if i+1 < len(order) and record_key(order[i]) == record_key(order[i+1]):
+                continue
+            keep.append(order[i])
+        for d in range(len(keys)):
+            keys[d] = array.array("i", [keys[d][p] for p in keep])
+        for i in range(len(self.values)):
+            self.values[i] = array.array("d", [self.values[i][p] for p in keep])
+        if self.typename == "Set":
+            self.text = array.array("i", [self.text[p] for p in keep])
+        self.ordered = True
+
+    def remove(self, records):
+        # Remove the records whose keys are in records, a dict or set of
+        # tuples of key indexes
+        keys = self.keys
+        keep = [p for p in range(len(self)) if not tuple([k[p] for k in keys]) in records]
+        for d in range(len(keys)):
+            keys[d] = array.array("i", [keys[d][p] for p in keep])
+        for i in range(len(self.values)):
+            self.values[i] = array.array("d", [self.values[i][p] for p in keep])
+        if self.typename == "Set":
+            self.text = array.array("i", [self.text[p] for p in keep])
+
+    def tree(self):
+        # Build the gdxdims for the gdxdict-style view of the symbol
+        self.sort()
+        parent = self.parent
+        is_set = self.typename == "Set"
+        has_limits = len(self.values) == len(level_names)
+        dims = len(self.keys)
+        root = gdxdim(parent)
+        for p in range(len(self)):
+            current = root
+            for d in range(dims-1):
+                i = self.keys[d][p]
+                if not i in current.items:
+                    current.items[i] = gdxdim(parent)
+                current = current.items[i]
+            i = self.keys[dims-1][p]
+            if is_set:
+                current.items[i] = True
+                if self.text[p] != 0:
+                    current.record_info(i).description = self.texts[self.text[p]]
+            else:
+                current.items[i] = self.values[gdxcc.GMS_VAL_LEVEL][p]
+            if has_limits:
+                current.record_info(i).limits = array.array("d", [v[p] for v in self.values])
+        return root
+
+
+def tree_to_columns(parent, s, info):
+    # The opposite of gdxcolumns.tree, for a symbol that's been read or built
+    # as gdxdims.  Variables missing limits get the defaults for their type
+    cols = gdxcolumns(parent, info["dims"], info["typename"])
+    defaults = default_variable_fields[info["userinfo"]]
+    def walk(s, d, prefix):
+        for i in sorted(s.items):
+            prefix[d] = i
+            v = s.items[i]
+            if isinstance(v, gdxdim):
+                walk(v, d+1, prefix)
+                continue
+            for dd in range(len(prefix)):
+                cols.keys[dd].append(prefix[dd])
+            kinfo = s.find_info(i)
+            if cols.typename == "Set":
+                cols.text.append(cols.add_text(kinfo.description if kinfo != None else None))
+            elif len(cols.values) == len(level_names):
+                limits = kinfo.limits if kinfo != None else None
+                for f in range(len(level_names)):
+                    cols.values[f].append(limit(limits, f, defaults))
+                cols.values[gdxcc.GMS_VAL_LEVEL][-1] = v
+            else:
+                cols.values[gdxcc.GMS_VAL_LEVEL].append(v)
+    walk(s, 0, [0] * info["dims"])
+    return cols
+
+
+#- A symbol stored as a flat dict ----------------------------------------------
+
+# A symbol can also be stored as one dict from tuples of key indexes to values
+# (True for sets, and levels for everything else), with a gdxinfo for the
+# records that have one.  For each dimension, an inverted index from key
+# indexes to the records with that key is built the first time a select needs
+# it, so a select with some dimensions fixed only has to look at the records
+# that have the rarest of its keys.
+# Like gdxcolumns, gdxdict.__getitem__ turns a gdxflat back into gdxdims.
+
+class gdxflat:
+
+    def __init__(self, parent, dims, typename, userinfo=0):
+        self.parent = parent
+        self.dims = dims
+        self.typename = typename
+        self.userinfo = userinfo
+        self.records = {}
+        self.info = {}
+        self.indexes = [None] * dims
+
+    def __len__(self):
+        return len(self.records)
+
+    def __setitem__(self, keys, value):
+        if not keys in self.records: self.indexes = [None] * self.dims
+        self.records[keys] = value
+
+    def __getitem__(self, keys):
+        return self.records[keys]
+
+    def __delitem__(self, keys):
+        del self.records[keys]
+        if keys in self.info: del self.info[keys]
+        self.indexes = [None] * self.dims
+
+    def __contains__(self, keys):
+        return keys in self.records
+
+    def index(self, d):
+        # The inverted index for dimension d
+        index = self.indexes[d]
+        if index == None:
+            index = {}
+            for r in self.records:
+                index.setdefault(r[d], []).append(r)
+            self.indexes[d] = index
+        return index
+
+    def select(self, keys):
+        # The keys of the records that match keys, which has a key index or
+        # None (for any key) for each dimension
+        fixed = []
+        for d in range(self.dims):
+            if keys[d] != None: fixed.append(d)
+        if len(fixed) == self.dims:
+            if tuple(keys) in self.records: return [tuple(keys)]
+            return []
+        if len(fixed) == 0:
+            return self.records.keys()
+
+        candidates = None
+        for d in fixed:
+            c = self.index(d).get(keys[d], [])
+            if candidates == None or len(c) < len(candidates): candidates = c
+        return [r for r in candidates if all(r[d] == keys[d] for d in fixed)]
+
+    def columns(self):
+        # The symbol as gdxcolumns, in universal set order
+        cols = gdxcolumns(self.parent, self.dims, self.typename)
+        is_set = self.typename == "Set"
+        has_limits = len(cols.values) == len(level_names)
+        defaults = default_variable_fields[self.userinfo]
+        for r in sorted(self.records):
+            for d in range(self.dims):
+                cols.keys[d].append(r[d])
+            kinfo = self.info.get(r)
+            if is_set:
+                cols.text.append(cols.add_text(kinfo.description if kinfo != None else None))
+            elif has_limits:
+                limits = kinfo.limits if kinfo != None else None
+                for f in range(len(level_names)):
+                    cols.values[f].append(limit(limits, f, defaults))
+                cols.values[gdxcc.GMS_VAL_LEVEL][-1] = self.records[r]
+            else:
+                cols.values[gdxcc.GMS_VAL_LEVEL].append(self.records[r])
+        return cols
+
+    def tree(self):
+        return self.columns().tree()
+
+
+def columns_to_flat(cols, userinfo=0):
+    flat = gdxflat(cols.parent, len(cols.keys), cols.typename, userinfo)
+    cols.sort()
+    is_set = cols.typename == "Set"
+    has_limits = len(cols.values) == len(level_names)
+    for p in range(len(cols)):
+        r = tuple([k[p] for k in cols.keys])
+        if is_set:
+            flat.records[r] = True
+            if cols.text[p] != 0:
+                ri = flat.info[r] = gdxinfo()
+                ri.description = cols.texts[cols.text[p]]
+        else:
+            flat.records[r] = cols.values[gdxcc.GMS_VAL_LEVEL][p]
+        if has_limits:
+            ri = flat.info[r] = gdxinfo()
+            ri.limits = array.array("d", [v[p] for v in cols.values])
+    return flat
 
 
 #- Reading tools ---------------------------------------------------------------
 
-def read_symbol(H, d, name, typename, values):
+# How many records to read at a time into a gdxcolumns
+read_batch_size = 10000
+
+
+def read_symbol(texts, d, name, typename, values):
     if typename == "Set":
         d[name] = True
     else:
         d[name] = values[gdxcc.GMS_VAL_LEVEL]
 
     if typename == "Variable" or typename == "Equation":
-        limits = {}
-        for i in range(5):
-            limits[level_names[i]] = values[i]
-        d.setinfo(name)["limits"] = limits
+        if isinstance(d, gdxdim):
+            d.record_info(d.index(name)).limits = array.array("d", values[0:len(level_names)])
+        else:
+            limits = {}
+            for i in range(len(level_names)):
+                limits[level_names[i]] = values[i]
+            d.setinfo(name)["limits"] = limits
 
     if typename == "Set":
-        ret, description, node = gdxcc.gdxGetElemText(H, int(values[gdxcc.GMS_VAL_LEVEL]))
-        if ret != 0:
+        description = texts.get(values[gdxcc.GMS_VAL_LEVEL])
+        if description != None:
             d.setinfo(name)["description"] = description
 
 
+def read_raw_symbol(texts, d, i, typename, values):
+    # The same as read_symbol, but i is the index of a key that's already in
+    # the universal set, so we can skip gdxdim.__setitem__
+    if typename == "Set":
+        d.items[i] = True
+    else:
+        d.items[i] = values[gdxcc.GMS_VAL_LEVEL]
+
+    if typename == "Variable" or typename == "Equation":
+        d.record_info(i).limits = array.array("d", values[0:len(level_names)])
+
+    if typename == "Set":
+        description = texts.get(values[gdxcc.GMS_VAL_LEVEL])
+        if description != None:
+            d.record_info(i).description = description
+
+
 #- Writing Tools ---------------------------------------------------------------
 
 values = gdxcc.doubleArray(gdxcc.GMS_VAL_MAX)
@@ -130,7 +645,7 @@ def set_symbol(H, d, name, typename, userinfo, values, dims):
         values[gdxcc.GMS_VAL_LEVEL] = d[name]
 
     if (typename == "Variable" or typename == "Equation") and "limits" in d.getinfo(name):
-        limits = d.getinfo[name]("limits")
+        limits = d.getinfo(name)["limits"]
         for i in range(1, 5):
             ln = level_names[i]
             if ln in limits:
@@ -139,24 +654,132 @@ def set_symbol(H, d, name, typename, userinfo, values, dims):
     gdxcc.gdxDataWriteStr(H, dims + [name], values)
 
 
-def write_symbol(H, typename, userinfo, s, dims):
-    for k in s:
-        s2 = s[k]
-        if isinstance(s2, gdxdim):
-            write_symbol(H, typename, userinfo, s2, dims + [k])
+def add_set_text(H, texts, text):
+    # Only add each distinct text to the file once: texts maps the texts
+    # we've already added to their numbers
+    if not text in texts:
+        ret, texts[text] = gdxcc.gdxAddSetText(H, text)
+    return texts[text]
+
+
+# gdxdict.write registers the universal set in order, so the raw UEL number
+# of parent.order[i] is i+1, and symbols can be written with gdxDataWriteRaw.
+# GDX wants raw records in order, so we walk each level of a gdxdim in
+# universal set order.
+
+def write_raw_symbol(H, s, dims, typename, userinfo, texts):
+    elements = [0] * dims
+    is_set = typename == "Set"
+    has_limits = typename == "Variable" or typename == "Equation"
+    defaults = default_variable_fields[userinfo]
+    if not has_limits:
+        for i in range(1, len(level_names)): values[i] = 0.0
+
+    def walk(s, d):
+        for i in sorted(s.items):
+            elements[d] = i + 1
+            v = s.items[i]
+            if isinstance(v, gdxdim):
+                walk(v, d+1)
+                continue
+            kinfo = s.find_info(i)
+            if is_set:
+                text_index = 0
+                if kinfo != None and kinfo.description != None:
+                    text_index = add_set_text(H, texts, kinfo.description)
+                values[gdxcc.GMS_VAL_LEVEL] = float(text_index)
+            else:
+                values[gdxcc.GMS_VAL_LEVEL] = v
+            if has_limits:
+                limits = kinfo.limits if kinfo != None else None
+                for f in range(1, len(level_names)):
+                    values[f] = limit(limits, f, defaults)
+            if not gdxcc.gdxDataWriteRaw(H, elements, values):
+                raise gdxx.GDX_error(H, "Error in gdxDataWriteRaw")
+
+    walk(s, 0)
+
+
+def write_columns(H, cols, texts):
+    # Write a symbol stored as columns with gdxDataWriteRaw
+    cols.sort()
+    keys = cols.keys
+    fields = cols.values
+    dims = len(keys)
+    is_set = cols.typename == "Set"
+    text_numbers = [0] * len(cols.texts)
+    for i in range(1, len(cols.texts)):
+        text_numbers[i] = add_set_text(H, texts, cols.texts[i])
+    elements = [0] * dims
+    for p in range(len(cols)):
+        for d in range(dims):
+            elements[d] = keys[d][p] + 1
+        if is_set:
+            values[gdxcc.GMS_VAL_LEVEL] = float(text_numbers[cols.text[p]])
         else:
-            set_symbol(H, s, k, typename, userinfo, values, dims)
+            for f in range(len(fields)):
+                values[f] = fields[f][p]
+        if not gdxcc.gdxDataWriteRaw(H, elements, values):
+            raise gdxx.GDX_error(H, "Error in gdxDataWriteRaw")
 
 
 #- Guessing domains ------------------------------------------------------------
 
-def guess_domains(G, set_map, all_keys):
+class set_index:
+    # An inverted index from each key to the 1-D sets it's in.  Each set gets a
+    # bit, and each key maps to a (Python long) bitset of the sets it's in, so
+    # finding all the sets that contain a collection of keys is an "and" for
+    # each key, rather than a dict intersection.
+
+    def __init__(self):
+        self.names = []
+        self.bits = {}
+        self.members = {}
+        # Sets of keys we've already worked out the containing sets for
+        self.memo = {}
+
+    def add_set(self, name, keys):
+        if not name in self.bits:
+            self.bits[name] = 1L << len(self.names)
+            self.names.append(name)
+        bit = self.bits[name]
+        members = self.members
+        for k in keys:
+            members[k] = members.get(k, 0L) | bit
+        self.memo = {}
+
+    def containing(self, keys):
+        # The bitset of the sets that contain all of keys
+        if len(keys) == 0: return 0L
+        memo_key = frozenset(keys)
+        if memo_key in self.memo: return self.memo[memo_key]
+        members = self.members
+        mask = -1L
+        for k in keys:
+            mask &= members.get(k, 0L)
+            if not mask: break
+        self.memo[memo_key] = mask
+        return mask
+
+    def set_names(self, mask):
+        names = []
+        i = 0
+        while mask:
+            if mask & 1: names.append(self.names[i])
+            mask >>= 1
+            i += 1
+        return names
+
+
+def guess_domains(G, sets, all_keys):
     # We don't always get symbol domains from GDX (in 23.7.2 and below
     # gdxSymbolGetDomain doesn't work and otherwise, some GDX files don't seem
-    # to contain this information).  So here we try to guess
+    # to contain this information).  So here we try to guess, using sets, a
+    # set_index of all the 1-D sets in the file
 
-    # Then run through all the symbols trying to guess any missing domains
-    for k in G:
+    # Then run through all the symbols we've just read trying to guess any
+    # missing domains
+    for k in all_keys:
         info = G.getinfo(k)
         if info["dims"] > 0:
             skip = True
@@ -170,21 +793,10 @@ def guess_domains(G, set_map, all_keys):
                 if info["domain"][i]["key"] != "*": continue
                 # For each dimension that currently has '*' as its domain,
                 # work out all the possible sets
-                pd = None
-                for j in keys[i]:
-                    if pd == None:
-                        pd = {}
-                        if j in set_map:
-                            for s in set_map[j]: pd[s] = True
-                    else:
-                        remove = []
-                        for s in pd:
-                            if not s in set_map[j]: remove.append(s)
-                        for r in remove: del pd[r]
-
+                mask = sets.containing(keys[i])
                 # If the symbol is a set itself, then we probably found that, but we don't want it
-                if pd and k in pd: del pd[k]
-                if pd and len(pd) > 0:
+                if k in sets.bits: mask &= ~sets.bits[k]
+                if mask:
                     # If we found more than one possible set, pick the shortest
                     # one: our guess is that the set is the smallest set that
                     # contains all the keys that appear in this dimension
@@ -196,7 +808,7 @@ def guess_domains(G, set_map, all_keys):
                     # of a longer set
                     if info["type"] == gdxcc.GMS_DT_SET:
                         min_length = len(keys[i])
-                    for s in pd:
+                    for s in sets.set_names(mask):
                         l = G.getinfo(s)["records"]
                         if l < length and l > min_length:
                             length = l
@@ -204,16 +816,406 @@ def guess_domains(G, set_map, all_keys):
                     if smallest_set:
                         info["domain"][i] = { "index":G.getinfo(smallest_set)["number"], "key":smallest_set }
 
+    # The memo is only worth keeping while we go through one batch of symbols
+    sets.memo = {}
+
 
 def guess_ancestor_domains(G):
+    # Every dimension with the same domain has the same chain of ancestors, so
+    # only work each chain out once
+    chains = { "*": ["*"] }
+    def ancestors(key):
+        if not key in chains:
+            chains[key] = [key] + ancestors(G.getinfo(key)["domain"][0]["key"])
+        return chains[key]
+
     for k in G:
         info = G.getinfo(k)
         if info["dims"] == 0: continue
         for i in range(info["dims"]):
-            ancestors = [info["domain"][i]["key"]]
-            while ancestors[-1] != '*':
-                ancestors.append(G.getinfo(ancestors[-1])["domain"][0]["key"])
-            info["domain"][i]["ancestors"] = ancestors
+            info["domain"][i]["ancestors"] = list(ancestors(info["domain"][i]["key"]))
+
+
+#- Cache tools -----------------------------------------------------------------
+
+# gdxdict.read(cache=True) keeps a copy of what it read from a GDX file in a
+# sidecar file next to it.  The sidecar starts with cache_magic and the
+# lengths of a stamp and a header, which are both JSON, so reading a cache
+# can't run anything.  The stamp has the size and modification time of the
+# GDX file, and is compared with what it should be before anything else is
+# decoded.  The header has the universal set, the symbol table with the
+# domains we guessed, and where each symbol's gdxcolumns arrays are in the
+# rest of the file.  The arrays are stored as raw machine words, so each one
+# is read with a single copy out of the mapped file rather than decoded value
+# by value.  They aren't used in place: gdxcolumns needs array.arrays, which
+# can't share the map's memory, and the keys are renumbered into our own
+# universal set anyway, so the map is closed once the arrays are read.
+# Anything wrong with a cache just means it isn't used.
+
+cache_magic = "gdxdict cache 2\n"
+cache_header = struct.Struct("<QQ")
+
+
+def cache_filename(filename):
+    return filename + ".cache"
+
+
+def cache_dumps(x):
+    # GDX strings are bytes rather than text, so they're passed through JSON
+    # as latin-1, which any byte can be
+    return json.dumps(x, sort_keys=True, encoding="latin-1")
+
+
+def cache_strings(x):
+    # Undo cache_dumps's encoding of strings in what json.loads gives back
+    if isinstance(x, unicode): return x.encode("latin-1")
+    if isinstance(x, list): return [cache_strings(v) for v in x]
+    if isinstance(x, dict):
+        return dict([(cache_strings(k), cache_strings(v)) for k, v in x.iteritems()])
+    return x
+
+
+def cache_stamp(filename):
+    # What has to match for a cache to be used, as it's stored in the cache
+    st = os.stat(filename)
+    return cache_dumps({
+      "source": os.path.abspath(filename),
+      "size": st.st_size,
+      "mtime": st.st_mtime,
+      "byteorder": sys.byteorder,
+      "itemsizes": (array.array("i").itemsize, array.array("d").itemsize),
+    })
+
+
+def write_cache(G, filename):
+    # Write everything in G, which must have been read from filename alone,
+    # to filename's cache
+    chunks = []
+    offset = [0]
+    def add_chunk(a):
+        data = a.tostring()
+        chunks.append(data)
+        place = (offset[0], len(data))
+        offset[0] += len(data)
+        return place
+
+    universe = []
+    for k in G.order:
+        universe.append((k, G.universal_description[k.lower()]))
+
+    symbols = []
+    for kl in G.symbols:
+        info = G.info[kl]
+        entry = { "info": info }
+        if info["dims"] == 0:
+            entry["value"] = G.symbols[kl]
+        else:
+            cols = G.columns(kl)
+            cols.sort()
+            entry["keys"] = [add_chunk(k) for k in cols.keys]
+            entry["values"] = [add_chunk(v) for v in cols.values]
+            entry["text"] = add_chunk(cols.text)
+            entry["texts"] = cols.texts
+        symbols.append(entry)
+
+    stamp = cache_stamp(filename)
+    header = cache_dumps({
+      "file_info": G.file_info,
+      "universe": universe,
+      "universal_info": G.universal_info,
+      "symbols": symbols,
+    })
+
+    # Write somewhere else and rename, so a reader never sees half a cache
+    output = cache_filename(filename)
+    temp = output + ".tmp"
+    out = open(temp, "wb")
+    out.write(cache_magic)
+    out.write(cache_header.pack(len(stamp), len(header)))
+    out.write(stamp)
+    out.write(header)
+    for c in chunks: out.write(c)
+    out.close()
+    if os.path.exists(output): os.remove(output)
+    os.rename(temp, output)
+
+
+def open_cache(filename):
+    # Map filename's cache and read its header, or return None if there's no
+    # cache or it's out of date
+    try:
+        cf = open(cache_filename(filename), "rb")
+    except IOError:
+        return None
+    try:
+        try:
+            mm = mmap.mmap(cf.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            return None
+        try:
+            start = len(cache_magic) + cache_header.size
+            if mm[:len(cache_magic)] != cache_magic: raise ValueError
+            stamp_length, header_length = cache_header.unpack(mm[len(cache_magic):start])
+            if mm[start:start+stamp_length] != cache_stamp(filename): raise ValueError
+            start += stamp_length
+            header = cache_strings(json.loads(mm[start:start+header_length]))
+            if not isinstance(header, dict): raise ValueError
+        except Exception:
+            mm.close()
+            return None
+        header["map"] = mm
+        header["data"] = start + header_length
+        return header
+    finally:
+        cf.close()
+
+
+def cache_array(cache, typecode, place):
+    # Copy an array out of the cache's map
+    offset, length = place
+    offset += cache["data"]
+    if offset < cache["data"] or length < 0 or offset + length > len(cache["map"]):
+        raise ValueError("Array outside the cache")
+    a = array.array(typecode)
+    a.fromstring(buffer(cache["map"], offset, length))
+    return a
+
+
+def check_cache_info(info, names):
+    # Raise an exception unless a symbol's info from a cache has everything
+    # it should, of the right types.  names has the names of the symbols
+    # its domains can be.
+    numbers = (int, long, float)
+    def check(ok):
+        if not ok: raise ValueError("Bad symbol information in cache")
+    check(isinstance(info["name"], str) and isinstance(info["typename"], str))
+    check(info["typename"].lower() in type_codes)
+    for k in "dims", "type", "userinfo", "records", "number":
+        check(isinstance(info.get(k, 0), int) and not isinstance(info.get(k, 0), bool))
+    check(info["dims"] >= 0 and 0 <= info.get("userinfo", 0) < len(default_variable_fields))
+    for k in "description", "full_typename":
+        check(isinstance(info.get(k, ""), str))
+    check(isinstance(info["domain"], list) and len(info["domain"]) == info["dims"])
+    for d in info["domain"]:
+        if d == None: continue
+        check(isinstance(d, dict) and isinstance(d["key"], str) and d["key"].lower() in names)
+        check(isinstance(d.get("index", 0), int))
+        ancestors = d.get("ancestors", [])
+        check(isinstance(ancestors, list))
+        for a in ancestors: check(isinstance(a, str) and a.lower() in names)
+    if "limits" in info:
+        check(isinstance(info["limits"], dict))
+        for k, v in info["limits"].iteritems():
+            check(k in level_names and isinstance(v, numbers) and not isinstance(v, bool))
+
+
+def cache_symbols(cache, names):
+    # Read the symbols out of a cache, checking that everything we'll use
+    # fits together.  Returns a list of (info, value) for scalars and
+    # (info, (keys, values, texts)) for everything else, where texts has the
+    # description of each set record.  names has the symbols that are already
+    # there, which domains can refer to as well as the cache's own symbols.
+    # Raises an exception if anything's wrong.
+    size = len(cache["universe"])
+    names = set(names)
+    names.add("*")
+    for entry in cache["symbols"]:
+        names.add(entry["info"]["name"].lower())
+    symbols = []
+    for entry in cache["symbols"]:
+        info = entry["info"]
+        check_cache_info(info, names)
+        dims = info["dims"]
+        typename = info["typename"]
+        if dims == 0:
+            value = entry["value"]
+            if not isinstance(value, (int, long, float)) or isinstance(value, bool):
+                raise ValueError("Bad scalar in cache")
+            symbols.append((info, value))
+            continue
+        if not typename in gdxx.symbol_type_text: raise ValueError("Bad type in cache")
+
+        keys = [cache_array(cache, "i", p) for p in entry["keys"]]
+        values = [cache_array(cache, "d", p) for p in entry["values"]]
+        text = cache_array(cache, "i", entry["text"])
+        n = len(keys[0]) if len(keys) > 0 else 0
+        if len(keys) != dims or len(values) != field_count(typename):
+            raise ValueError("Wrong number of arrays in cache")
+        for a in keys + values:
+            if len(a) != n: raise ValueError("Arrays of different lengths in cache")
+        if n > 0 and (min(map(min, keys)) < 0 or max(map(max, keys)) >= size):
+            raise ValueError("Key outside the universal set in cache")
+        texts = None
+        if typename == "Set":
+            texts = [entry["texts"][t] for t in text]
+            if len(texts) != n: raise ValueError("Wrong number of descriptions in cache")
+            for t in texts:
+                if t != None and not isinstance(t, str): raise ValueError("Bad description in cache")
+        symbols.append((info, (keys, values, texts)))
+    return symbols
+
+
+#- Aggregation tools -----------------------------------------------------------
+
+# Each aggregator takes a list of (group, value) pairs and returns a dict of
+# the aggregated value for each group
+
+def aggregate_sum(pairs):
+    acc = {}
+    for g, v in pairs:
+        acc[g] = acc.get(g, 0.0) + v
+    return acc
+
+
+def aggregate_count(pairs):
+    acc = {}
+    for g, v in pairs:
+        acc[g] = acc.get(g, 0.0) + 1.0
+    return acc
+
+
+def aggregate_min(pairs):
+    acc = {}
+    for g, v in pairs:
+        if not g in acc or v < acc[g]: acc[g] = v
+    return acc
+
+
+def aggregate_max(pairs):
+    acc = {}
+    for g, v in pairs:
+        if not g in acc or v > acc[g]: acc[g] = v
+    return acc
+
+
+def aggregate_mean(pairs):
+    sums = aggregate_sum(pairs)
+    counts = aggregate_count(pairs)
+    for g in sums: sums[g] /= counts[g]
+    return sums
+
+
+aggregators = {
+  "sum": aggregate_sum,
+  "count": aggregate_count,
+  "min": aggregate_min,
+  "max": aggregate_max,
+  "mean": aggregate_mean,
+}
+
+
+# gdxdict.aggregate groups records with one of the two functions below, which
+# both take an array of key indexes for each kept dimension, an array of
+# values, and for each kept dimension, None or the sorted gdxcolumns of the
+# set it's mapped through.  They return an array of key indexes for each
+# kept dimension and an array of values, with a record for each group in
+# universal set order.
+
+def aggregate_loop(keys, values, map_sets, how):
+    # Group the records in a dict, for when NumPy isn't there
+    mappings = []
+    for m in map_sets:
+        if m == None:
+            mappings.append(None)
+            continue
+        mapping = {}
+        for a, b in zip(m.keys[0], m.keys[1]):
+            mapping.setdefault(a, []).append(b)
+        mappings.append(mapping)
+
+    if len(keys) > 0:
+        groups = zip(*keys)
+    else:
+        groups = [()] * len(values)
+    if mappings.count(None) == len(mappings):
+        pairs = zip(groups, values)
+    else:
+        pairs = []
+        for g, v in zip(groups, values):
+            options = []
+            for i in range(len(g)):
+                if mappings[i] == None:
+                    options.append((g[i],))
+                else:
+                    options.append(mappings[i].get(g[i], ()))
+            for mg in itertools.product(*options):
+                pairs.append((mg, v))
+
+    acc = aggregators[how](pairs)
+    order = sorted(acc)
+    result_keys = [array.array("i", [g[i] for g in order]) for i in range(len(keys))]
+    return result_keys, array.array("d", [acc[g] for g in order])
+
+
+def aggregate_arrays(numpy, keys, values, map_sets, how):
+    # Sort the records by group and reduce each run of records in a group,
+    # all on whole arrays
+    keys = [numpy.frombuffer(k, dtype=numpy.intc) for k in keys]
+    values = numpy.frombuffer(values, dtype=numpy.float64)
+
+    # Give each record a copy for each key its mapped keys map to
+    for i in range(len(keys)):
+        m = map_sets[i]
+        if m == None: continue
+        a = numpy.frombuffer(m.keys[0], dtype=numpy.intc)
+        b = numpy.frombuffer(m.keys[1], dtype=numpy.intc)
+        first = numpy.searchsorted(a, keys[i], "left")
+        counts = numpy.searchsorted(a, keys[i], "right") - first
+        records = numpy.repeat(numpy.arange(len(counts)), counts)
+        within = numpy.arange(len(records)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        keys = [k[records] for k in keys]
+        keys[i] = b[first[records] + within]
+        values = values[records]
+
+    n = len(values)
+    if n == 0:
+        return [array.array("i") for k in keys], array.array("d")
+    if len(keys) > 0:
+        # lexsort sorts on its last key first
+        order = numpy.lexsort(keys[::-1])
+        keys = [k[order] for k in keys]
+        values = values[order]
+        change = numpy.zeros(n, dtype=bool)
+        change[0] = True
+        for k in keys: change[1:] |= k[1:] != k[:-1]
+        starts = numpy.nonzero(change)[0]
+    else:
+        starts = numpy.zeros(1, dtype=numpy.intp)
+
+    if how == "sum":
+        result = numpy.add.reduceat(values, starts)
+    elif how == "min":
+        result = numpy.minimum.reduceat(values, starts)
+    elif how == "max":
+        result = numpy.maximum.reduceat(values, starts)
+    else:
+        result = numpy.diff(numpy.append(starts, n)).astype(numpy.float64)
+        if how == "mean": result = numpy.add.reduceat(values, starts) / result
+
+    result_keys = []
+    for k in keys:
+        rk = array.array("i")
+        rk.fromstring(k[starts].astype(numpy.intc).tostring())
+        result_keys.append(rk)
+    rv = array.array("d")
+    rv.fromstring(result.astype(numpy.float64).tostring())
+    return result_keys, rv
+
+
+#- Dense array tools -----------------------------------------------------------
+
+# The largest array gdxdict.to_dense will make, in bytes, unless it's told
+# otherwise
+max_dense_bytes = 1 << 30
+
+
+def import_numpy():
+    # NumPy is optional, so only import it when something needs it
+    try:
+        import numpy
+    except ImportError:
+        raise gdxdict_error("This needs NumPy, which isn't installed")
+    return numpy
 
 
 #- GDX Dict --------------------------------------------------------------------
@@ -227,17 +1229,74 @@ class gdxdict:
         self.universal_info = {}
         self.order = []
         self.universal_description = {}
+        # Every spelling of every key we've seen, and its index in order
+        self.spellings = {}
 
         self.symbols = {}
         self.symbol_names = {}
         self.info = {}
 
+        # Files opened with read(lazy=True), and the symbols in them that
+        # haven't been loaded yet
+        self.files = []
+        self.pending = {}
+
 
     def __getitem__(self, key):
-        return self.symbols[key.lower()]
+        kl = key.lower()
+        if kl in self.pending: self.load(kl)
+        s = self.symbols[kl]
+        if isinstance(s, gdxcolumns) or isinstance(s, gdxflat):
+            s = self.symbols[kl] = s.tree()
+        return s
 
     def __setitem__(self, key, value):
-        self.symbols[key.lower()] = value
+        kl = key.lower()
+        # A symbol that's replaced doesn't need loading any more
+        if kl in self.pending: del self.pending[kl]
+        self.symbols[kl] = self.adopt(value)
+
+    def adopt(self, s):
+        # If s is a symbol's storage from another gdxdict, a copy of it with
+        # its keys mapped to indexes in our universal set.  Otherwise, s.
+        if not isinstance(s, (gdxdim, gdxcolumns, gdxflat)) or s.parent is self:
+            return s
+        G = s.parent
+        umap = {}
+        def key_index(i):
+            if not i in umap:
+                umap[i] = self.add_key(G.order[i], G.universal_description.get(G.order[i].lower()))
+            return umap[i]
+
+        if isinstance(s, gdxdim):
+            d = gdxdim(self)
+            for i, v in s.items.iteritems():
+                j = key_index(i)
+                if isinstance(v, gdxdim): v = self.adopt(v)
+                d.items[j] = v
+                ri = s.find_info(i)
+                if ri != None:
+                    if d.info == None: d.info = {}
+                    d.info[j] = ri
+            return d
+
+        if isinstance(s, gdxcolumns):
+            cols = gdxcolumns(self, len(s.keys), s.typename)
+            for d in range(len(s.keys)):
+                cols.keys[d] = array.array("i", [key_index(i) for i in s.keys[d]])
+            cols.values = [array.array("d", v) for v in s.values]
+            cols.text = array.array("i", s.text)
+            cols.texts = list(s.texts)
+            cols.text_index = dict(s.text_index)
+            cols.ordered = False
+            return cols
+
+        flat = gdxflat(self, s.dims, s.typename, s.userinfo)
+        for r, v in s.records.iteritems():
+            fr = tuple([key_index(i) for i in r])
+            flat.records[fr] = v
+            if r in s.info: flat.info[fr] = s.info[r]
+        return flat
 
     def __contains__(self, key):
         return key.lower() in self.symbols
@@ -279,12 +1338,71 @@ class gdxdict:
         else:
             return self.info[kl]
 
-    def add_key(self, key, description=None):
+    def columns(self, key):
+        # Get a symbol as a gdxcolumns, converting it if it's stored as gdxdims
         kl = key.lower()
-        if not kl in self.universal:
-            self.universal[kl] = len(self.order)
+        if kl in self.pending: self.load(kl)
+        s = self.symbols[kl]
+        if isinstance(s, gdxdim):
+            s = self.symbols[kl] = tree_to_columns(self, s, self.info[kl])
+        elif isinstance(s, gdxflat):
+            s = self.symbols[kl] = s.columns()
+        return s
+
+    def flat(self, key):
+        # Get a symbol as a gdxflat, converting it if it's stored another way
+        kl = key.lower()
+        if self.info[kl]["dims"] == 0:
+            raise gdxdict_error("'%s' has no dimensions" % key)
+        s = self.symbols[kl]
+        if isinstance(s, gdxflat) and not kl in self.pending: return s
+        s = self.symbols[kl] = columns_to_flat(self.columns(kl), self.info[kl]["userinfo"])
+        return s
+
+    def select(self, name, *keys):
+        # The records of a symbol that match keys, which has a key, or None for
+        # any key, for each dimension, as a list of (keys, value) in universal
+        # set order.  For example, select("x", None, "chicago") is every
+        # record of x with chicago as its second key.  Sets have a value of
+        # True.  The symbol is stored as a gdxflat to do this.
+        s = self.flat(name)
+        if len(keys) != s.dims:
+            raise gdxdict_error("'%s' has %d dimensions, not %d" % (name, s.dims, len(keys)))
+        ikeys = []
+        for k in keys:
+            if k == None:
+                ikeys.append(None)
+            else:
+                i = self.key_index(k)
+                if i == None: return []
+                ikeys.append(i)
+        order = self.order
+        result = []
+        for r in sorted(s.select(ikeys)):
+            result.append((tuple([order[i] for i in r]), s.records[r]))
+        return result
+
+    def key_index(self, key):
+        # The index of a key in the universal set, or None if it's not there.
+        # Each spelling of a key is only case-folded the first time we see it
+        i = self.spellings.get(key)
+        if i == None:
+            i = self.universal.get(key.lower())
+            if i != None: self.spellings[key] = i
+        return i
+
+    def add_key(self, key, description=None):
+        # Returns the key's index in the universal set
+        i = self.key_index(key)
+        if i == None:
+            kl = key.lower()
+            i = self.universal[kl] = len(self.order)
             self.order.append(key)
-        self.universal_description[kl] = description
+            self.spellings[key] = i
+            self.universal_description[kl] = description
+        elif description != None:
+            self.universal_description[self.order[i].lower()] = description
+        return i
 
     def add_symbol(self, info):
         key = info["name"].lower()
@@ -337,7 +1455,147 @@ class gdxdict:
 
 # -- Read a gdx file -----------------------------------------------------------
 
-    def read(self, filename, gams_dir=None):
+    def read_file_symbol(self, f, num, sinfo, all_keys):
+        if f["columnar"] and sinfo["dims"] > 0:
+            self.read_symbol_columns(f["H"], f["texts"], num, sinfo, all_keys, f["umap"], f["ordered"])
+        else:
+            self.read_symbol_records(f["H"], f["texts"], num, sinfo, all_keys, f["uels"], f["raw"])
+
+
+    def read_symbol_records(self, H, texts, num, sinfo, all_keys, uels, raw=False):
+        self.add_symbol(sinfo)
+        symbol_name = sinfo["name"]
+        typename = sinfo["typename"]
+        dims = sinfo["dims"]
+        kl = symbol_name.lower()
+        if isinstance(self.symbols[kl], gdxcolumns) or isinstance(self.symbols[kl], gdxflat):
+            self.symbols[kl] = self.symbols[kl].tree()
+        all_keys[symbol_name] = []
+        keys = all_keys[symbol_name]
+        for d in range(dims): keys.append({})
+
+        if raw:
+            mode = "raw"
+        else:
+            mode = "str"
+
+        for elements, values in gdxx.iter_records(H, num, mode):
+            if dims == 0:
+                read_symbol(texts, self, symbol_name, typename, values)
+            elif raw:
+                # Elements are raw UEL numbers: look up their lower-case
+                # names and go straight to the gdxdims' dicts
+                current = self.symbols[symbol_name.lower()]
+                for d in range(dims-1):
+                    e = elements[d]
+                    keys[d][e] = True
+                    i = uels[e]
+                    if not i in current.items:
+                        current.items[i] = gdxdim(self)
+                    current = current.items[i]
+                e = elements[dims-1]
+                keys[dims-1][e] = True
+                read_raw_symbol(texts, current, uels[e], typename, values)
+            else:
+                current = self.symbols[symbol_name.lower()]
+                for d in range(dims-1):
+                    key = elements[d]
+                    keys[d][key] = True
+                    if not key in current:
+                        current[key] = gdxdim(self)
+                    current = current[key]
+                key = elements[dims-1]
+                keys[dims-1][key] = True
+                read_symbol(texts, current, key, typename, values)
+
+
+    def read_symbol_columns(self, H, texts, num, sinfo, all_keys, umap, ordered):
+        # Like read_symbol_records, but straight into a gdxcolumns.  umap maps
+        # the file's raw UEL numbers to indexes in our universal set
+        self.add_symbol(sinfo)
+        kl = sinfo["name"].lower()
+        dims = sinfo["dims"]
+        symbol = self.symbols[kl]
+        if isinstance(symbol, gdxdim):
+            if len(symbol.items) == 0:
+                symbol = gdxcolumns(self, dims, sinfo["typename"])
+            else:
+                symbol = tree_to_columns(self, symbol, self.info[kl])
+        elif isinstance(symbol, gdxflat):
+            symbol = symbol.columns()
+        self.symbols[kl] = symbol
+
+        start = len(symbol)
+        if start > 0 or not ordered: symbol.ordered = False
+        keys = symbol.keys
+        fields = symbol.values
+        is_set = sinfo["typename"] == "Set"
+        if is_set:
+            # Sets only need the level, which is the text number
+            read_fields = [gdxcc.GMS_VAL_LEVEL]
+        else:
+            read_fields = range(len(fields))
+
+        for batch_keys, batch_values in gdxx.iter_records(H, num, "raw", read_fields, read_batch_size):
+            for d in range(dims):
+                keys[d].extend([umap[e] for e in batch_keys[d]])
+            if is_set:
+                for t in batch_values[0]:
+                    symbol.text.append(symbol.add_text(texts.get(t)))
+            else:
+                for f in range(len(fields)):
+                    fields[f].extend(batch_values[f])
+
+        # Keys for guess_domains are indexes into our universal set
+        symbol_keys = []
+        for d in range(dims):
+            symbol_keys.append(dict.fromkeys(keys[d][start:], True))
+        all_keys[sinfo["name"]] = symbol_keys
+
+
+    def read_universe(self, H, texts):
+        uinfo = gdxx.symbol_info(H, 0)
+        for k in uinfo:
+            if not k in self.universal_info: 
+                self.universal_info[k] = uinfo[k]
+
+        # Records in the universal set come out in raw UEL order, so as we go,
+        # build a map from raw UEL numbers to indexes in our universal set
+        uels = [None]
+        for elements, values in gdxx.iter_records(H, 0):
+            uels.append(self.add_key(elements[0], texts.get(values[gdxcc.GMS_VAL_LEVEL])))
+        return uels
+
+
+    # If raw is true, records are read as integer UEL numbers with
+    # gdxDataReadRaw, and only mapped to names through the universal set,
+    # rather than having GDX build a list of strings for every record.
+    #
+    # If lazy is true, only the universal set and the symbol table are read,
+    # the file is left open, and each symbol's records are read the first time
+    # it's used (see load, load_all and close).
+    #
+    # If columnar is true, symbols are read into gdxcolumns rather than gdxdims
+    # (always using gdxDataReadRaw).
+    # With cache=True, the file is read from its cache if it has one that's up
+    # to date.  Otherwise the file is read in full, and the cache is written.
+    # Symbols read through the cache are always loaded.
+    def read(self, filename, gams_dir=None, raw=False, lazy=False, columnar=False, cache=False):
+        if cache:
+            if self.read_cache(filename): return
+            if len(self.order) == 0 and len(self.symbols) == 0:
+                G = self
+            else:
+                G = gdxdict()
+            G.read(filename, gams_dir, columnar=True)
+            try:
+                write_cache(G, filename)
+            except (IOError, OSError):
+                pass
+            if not G is self and not self.read_cache(filename):
+                self.read(filename, gams_dir, raw, lazy, columnar)
+            return
+
         H = gdxx.open(gams_dir)
         assert gdxcc.gdxOpenRead(H, filename)[0], "Couldn't open %s" % filename
 
@@ -347,89 +1605,742 @@ class gdxdict:
                 self.file_info[k] = info[k]
 
         # read the universal set
-        uinfo = gdxx.symbol_info(H, 0)
-        for k in uinfo:
-            if not k in self.universal_info: 
-                self.universal_info[k] = uinfo[k]
-
-        ok, records = gdxcc.gdxDataReadStrStart(H, 0)        
-        for i in range(records):
-            ok, elements, values, afdim = gdxcc.gdxDataReadStr(H)
-            if not ok: raise gdxx.GDX_error(H, "Error in gdxDataReadStr")
-            key = elements[0]
-            ret, description, node = gdxcc.gdxGetElemText(H, int(values[gdxcc.GMS_VAL_LEVEL]))
-            if ret == 0: description = None
-            self.add_key(key, description)
+        texts = gdxx.elem_text_cache(H)
+        uels = self.read_universe(H, texts)
+
+        f = {
+          "filename": filename,
+          "gams_dir": gams_dir,
+          "H": H,
+          "texts": texts,
+          "uels": uels,
+          "raw": raw,
+          "columnar": columnar,
+        }
+        if columnar or lazy:
+            # If the file's UELs are in the same order as ours, records will
+            # come out of the file in our order too
+            umap = [-1] + uels[1:]
+            f["umap"] = umap
+            f["ordered"] = True
+            for i in range(2, len(umap)):
+                if umap[i] < umap[i-1]:
+                    f["ordered"] = False
+                    break
+
+        if lazy:
+            self.read_symbol_table(f, info["symbol_count"])
+            return
 
         all_keys = {}
 
         # Read all the 1-D sets
-        # Map backwards so we have a map from every set key back to all the sets it's in
-        set_map = {}
+        # Index them so we have a map from every set key back to all the sets it's in
+        # (when reading raw, the keys in sets and all_keys are UEL numbers)
+        sets = set_index()
         for i in range(1, info["symbol_count"]+1):
             sinfo = gdxx.symbol_info(H, i)
             if sinfo["typename"] == "Set" and sinfo["dims"] == 1:
-
-                self.add_symbol(sinfo)
+                self.read_file_symbol(f, i, sinfo, all_keys)
                 symbol_name = sinfo["name"]
-                all_keys[symbol_name] = [{}]
-                keys = all_keys[symbol_name]
-                symbol = self[symbol_name]
-                ok, records = gdxcc.gdxDataReadStrStart(H, i)
-                for i in range(records):
-                    ok, elements, values, afdim = gdxcc.gdxDataReadStr(H)
-                    if not ok: raise gdxx.GDX_error(H, "Error in gdxDataReadStr")
-                    e = elements[0]
-                    read_symbol(H, symbol, e, sinfo["typename"], values)
-                    if not e in set_map: set_map[e] = {}
-                    set_map[e][symbol_name] = True
-                    keys[0][e] = True
+                sets.add_set(symbol_name, all_keys[symbol_name][0])
 
         # Read all the other symbols
         for i in range(1, info["symbol_count"]+1):
-
             sinfo = gdxx.symbol_info(H, i)
             if sinfo["typename"] == "Set" and sinfo["dims"] == 1: continue
+            self.read_file_symbol(f, i, sinfo, all_keys)
 
-            self.add_symbol(sinfo)
-            symbol_name = sinfo["name"]
-            all_keys[symbol_name] = []
-            keys = all_keys[symbol_name]
-            for d in range(sinfo["dims"]): keys.append({})
+        gdxcc.gdxClose(H)
+        gdxcc.gdxFree(H)
 
-            ok, records = gdxcc.gdxDataReadStrStart(H, i)
-        
-            for i in range(records):
-                ok, elements, values, afdim = gdxcc.gdxDataReadStr(H)
-                if not ok: raise gdxx.GDX_error(H, "Error in gdxDataReadStr")
-                if sinfo["dims"] == 0:
-                    read_symbol(H, self, symbol_name, sinfo["typename"], values)
-                else:
-                    symbol = self[sinfo["name"]]
-                    current = symbol
-                    for d in range(sinfo["dims"]-1):
-                        key = elements[d]
-                        keys[d][key] = True
-                        if not key in current:
-                            current[key] = gdxdim(self)
-                        current = current[key]
-                    d = sinfo["dims"]-1
-                    key = elements[d]
-                    keys[d][key] = True
-                    read_symbol(H, current, key, sinfo["typename"], values)
+        guess_domains(self, sets, all_keys)
+        guess_ancestor_domains(self)
+
+
+# -- Read just the symbol table ------------------------------------------------
+
+    # Read the file information and the symbol table (names, types, domains
+    # and record counts) without reading any records or guessing any domains
+    def read_info(self, filename, gams_dir=None):
+        H = gdxx.open(gams_dir)
+        assert gdxcc.gdxOpenRead(H, filename)[0], "Couldn't open %s" % filename
+
+        info = gdxx.file_info(H)
+        for k in info:
+            if not k in self.file_info:
+                self.file_info[k] = info[k]
+
+        for i in range(1, info["symbol_count"]+1):
+            self.add_symbol(gdxx.symbol_info(H, i))
 
         gdxcc.gdxClose(H)
         gdxcc.gdxFree(H)
 
-        guess_domains(self, set_map, all_keys)
         guess_ancestor_domains(self)
 
 
+# -- Read a file's cache -------------------------------------------------------
+
+    def read_cache(self, filename):
+        # Returns False, without changing anything, if filename doesn't have a
+        # cache we can use
+        cache = open_cache(filename)
+        if not cache: return False
+
+        try:
+            try:
+                universe = cache["universe"]
+                for k, description in universe:
+                    if not isinstance(k, str) or not (description == None or isinstance(description, str)):
+                        raise ValueError("Bad key in cache")
+                file_info = dict(cache["file_info"])
+                universal_info = dict(cache["universal_info"])
+                symbols = cache_symbols(cache, self.symbols.keys())
+            except Exception:
+                return False
+        finally:
+            cache["map"].close()
+
+        for k in file_info:
+            if not k in self.file_info:
+                self.file_info[k] = file_info[k]
+        for k in universal_info:
+            if not k in self.universal_info:
+                self.universal_info[k] = universal_info[k]
+
+        # Map the cache's UELs onto ours.  If we didn't have any UELs already,
+        # they're the same and the key arrays can be used as-is
+        umap = []
+        for k, description in universe:
+            umap.append(self.add_key(k, description))
+        same = True
+        ordered = True
+        for i in range(len(umap)):
+            if umap[i] != i: same = False
+            if i > 0 and umap[i] < umap[i-1]:
+                ordered = False
+                break
+
+        for sinfo, value in symbols:
+            self.add_symbol(sinfo)
+            kl = sinfo["name"].lower()
+            dims = sinfo["dims"]
+            if dims == 0:
+                self.symbols[kl] = value
+                continue
+
+            symbol = self.symbols[kl]
+            if isinstance(symbol, gdxdim):
+                if len(symbol.items) == 0:
+                    symbol = gdxcolumns(self, dims, sinfo["typename"])
+                else:
+                    symbol = tree_to_columns(self, symbol, self.info[kl])
+            elif isinstance(symbol, gdxflat):
+                symbol = symbol.columns()
+            self.symbols[kl] = symbol
+            if len(symbol) > 0 or not ordered: symbol.ordered = False
+
+            keys, values, texts = value
+            for d in range(dims):
+                if not same: keys[d] = array.array("i", [umap[k] for k in keys[d]])
+                symbol.keys[d].extend(keys[d])
+            for f in range(len(symbol.values)):
+                symbol.values[f].extend(values[f])
+            if texts != None:
+                for t in texts:
+                    symbol.text.append(symbol.add_text(t))
+
+        guess_ancestor_domains(self)
+        return True
+
+
+# -- Lazy loading --------------------------------------------------------------
+
+    def read_symbol_table(self, f, symbol_count):
+        st = os.stat(f["filename"])
+        f["size"] = st.st_size
+        f["mtime"] = st.st_mtime
+        f["sets"] = []
+        f["set_index"] = set_index()
+        self.files.append(f)
+
+        for i in range(1, symbol_count+1):
+            sinfo = gdxx.symbol_info(f["H"], i)
+            self.add_symbol(sinfo)
+            entry = (f, i, sinfo)
+            kl = sinfo["name"].lower()
+            if not kl in self.pending: self.pending[kl] = []
+            self.pending[kl].append(entry)
+            if sinfo["typename"] == "Set" and sinfo["dims"] == 1:
+                f["sets"].append(entry)
+
+        guess_ancestor_domains(self)
+
+
+    def lazy_open(self, f):
+        # Open a file again, but only if it's still the file we read the
+        # symbol table from
+        st = os.stat(f["filename"])
+        if st.st_size != f["size"] or st.st_mtime != f["mtime"]:
+            raise gdxdict_error("'%s' has changed since it was opened" % f["filename"])
+        H = gdxx.open(f["gams_dir"])
+        assert gdxcc.gdxOpenRead(H, f["filename"])[0], "Couldn't open %s" % f["filename"]
+        return H
+
+
+    def lazy_handle(self, f):
+        # If the file's been closed, open it again
+        if not f["H"]:
+            f["H"] = self.lazy_open(f)
+            f["texts"] = gdxx.elem_text_cache(f["H"])
+        return f["H"]
+
+
+    def lazy_read(self, f, num, sinfo):
+        all_keys = {}
+        self.lazy_handle(f)
+        self.read_file_symbol(f, num, sinfo, all_keys)
+        if sinfo["typename"] == "Set" and sinfo["dims"] == 1:
+            symbol_name = sinfo["name"]
+            f["set_index"].add_set(symbol_name, all_keys[symbol_name][0])
+        return all_keys
+
+
+    def lazy_sets(self, f):
+        # Guessing domains needs all the 1-D sets in a file, so read any we
+        # haven't already
+        all_keys = {}
+        for entry in f["sets"]:
+            kl = entry[2]["name"].lower()
+            if kl in self.pending and entry in self.pending[kl]:
+                self.pending[kl].remove(entry)
+                if len(self.pending[kl]) == 0: del self.pending[kl]
+                all_keys.update(self.lazy_read(*entry))
+        f["sets"] = []
+        guess_domains(self, f["set_index"], all_keys)
+
+
+    def load(self, key):
+        kl = key.lower()
+        if not kl in self.pending: return
+        for entry in self.pending.pop(kl):
+            f, num, sinfo = entry
+            all_keys = self.lazy_read(f, num, sinfo)
+            for d in sinfo["domain"]:
+                if d["key"] == "*":
+                    self.lazy_sets(f)
+                    guess_domains(self, f["set_index"], all_keys)
+                    break
+        guess_ancestor_domains(self)
+
+
+    def guess_pending_domains(self, kl):
+        # A symbol that's copied across without being loaded gets the domains
+        # read would have guessed for it.  That only needs the keys in each
+        # of its dimensions (in the form read_file_symbol would have given
+        # them to guess_domains), and the file's 1-D sets.
+        info = self.info[kl]
+        for entry in list(self.pending[kl]):
+            if not "*" in [d["key"] for d in info["domain"]]: break
+            f, num, sinfo = entry
+            # Reading the sets guesses their domains, and loads this symbol
+            # if it's one of them
+            self.lazy_sets(f)
+            if not entry in self.pending.get(kl, []): continue
+            dims = sinfo["dims"]
+            keys = [{} for d in range(dims)]
+            if f["raw"] or f["columnar"]:
+                mode = "raw"
+            else:
+                mode = "str"
+            for elements, values in gdxx.iter_records(self.lazy_handle(f), num, mode):
+                for d in range(dims): keys[d][elements[d]] = True
+            if f["columnar"]:
+                umap = f["umap"]
+                keys = [dict.fromkeys([umap[e] for e in k], True) for k in keys]
+            guess_domains(self, f["set_index"], { sinfo["name"]: keys })
+
+
+    def guess_symbol_domains(self, key):
+        # Guess a symbol's * domains as load would, but if it hasn't been
+        # loaded, only read its keys, rather than keeping its records
+        kl = key.lower()
+        if self.info[kl]["dims"] > 0 and self.unloaded(kl):
+            self.guess_pending_domains(kl)
+            guess_ancestor_domains(self)
+        else:
+            self.load(kl)
+
+
+    def discard_pending(self):
+        # Forget about the symbols that haven't been loaded (they're left
+        # empty) and close the files, so that the gdxdict can be pickled
+        self.pending = {}
+        self.close()
+
+
+    def load_all(self):
+        for kl in list(self.pending):
+            self.load(kl)
+        self.close()
+
+
+    def close(self):
+        # Symbols that haven't been loaded yet can still be used after close:
+        # their files will be opened again
+        for f in self.files:
+            if f["H"]:
+                gdxcc.gdxClose(f["H"])
+                gdxcc.gdxFree(f["H"])
+                f["H"] = None
+        if len(self.pending) == 0:
+            self.files = []
+
+
+# -- Iterate over records ------------------------------------------------------
+
+    def records(self, key):
+        # The records of a symbol with one or more dimensions, in universal set
+        # order, as (keys, level, description), where keys are indexes into
+        # the universal set.  Sets have a level of True.  Symbols that haven't
+        # been loaded are streamed from their files, and stay unloaded.
+        kl = key.lower()
+        is_set = self.info[kl]["typename"] == "Set"
+
+        if self.unloaded(kl):
+            for keys, n, record_values, text in self.pending_stream(kl):
+                if is_set:
+                    yield keys, True, text
+                else:
+                    yield keys, record_values[gdxcc.GMS_VAL_LEVEL], None
+            return
+
+        self.load(kl)
+        s = self.symbols[kl]
+        if isinstance(s, gdxflat): s = s.columns()
+
+        if isinstance(s, gdxcolumns):
+            s.sort()
+            for p in range(len(s)):
+                keys = tuple([k[p] for k in s.keys])
+                if is_set:
+                    yield keys, True, s.texts[s.text[p]]
+                else:
+                    yield keys, s.values[gdxcc.GMS_VAL_LEVEL][p], None
+            return
+
+        def walk(s, prefix):
+            for i in sorted(s.items):
+                keys = prefix + (i,)
+                v = s.items[i]
+                if isinstance(v, gdxdim):
+                    for r in walk(v, keys): yield r
+                    continue
+                if is_set: v = True
+                kinfo = s.find_info(i)
+                yield keys, v, kinfo.description if kinfo != None else None
+        for r in walk(s, ()): yield r
+
+
+# -- Add records ---------------------------------------------------------------
+
+    # Add the keys in key_columns, which has a sequence of keys for each
+    # dimension of a batch of records, to the universal set.  New keys are
+    # added in the order they first appear, row by row, as they would be if
+    # they were added one record at a time.  Returns an array("i") of key
+    # indexes for each dimension.
+    def add_keys(self, key_columns):
+        index = {}
+        new_keys = []
+        for d in range(len(key_columns)):
+            column = key_columns[d]
+            count = len(column)
+            firsts = dict(itertools.izip(reversed(column), xrange(count-1, -1, -1)))
+            for k in firsts:
+                if k in index: continue
+                i = self.key_index(k)
+                if i == None: new_keys.append((firsts[k], d, k))
+                else: index[k] = i
+        new_keys.sort()
+        for p, d, k in new_keys:
+            index[k] = self.add_key(k)
+        return [array.array("i", map(index.__getitem__, c)) for c in key_columns]
+
+    # Add a batch of records to a symbol that's been added with add_symbol.
+    # keys is an iterable of tuples of keys (or of keys, for a symbol with
+    # one dimension), or if columns is True, a list with a sequence of keys
+    # for each dimension.  values has a level for each record.  For variables
+    # and equations, fields can map the other names in level_names to
+    # sequences of values, and the fields that aren't given get the defaults
+    # for the variable's type.  For sets, values can be None to add every
+    # record, or a flag for each record, and records with false flags are
+    # removed.  texts can give a description (or None) for each set record.
+    # Records that are already in the symbol are replaced, and the symbol
+    # ends up stored as a gdxcolumns.  If the symbol has no type yet, it
+    # becomes a set if values is None and a parameter otherwise.
+    # The checks on the symbol are made once for the batch, new keys are
+    # added to the universal set together (in the order they first appear,
+    # row by row), and the columns are built from whole arrays.
+    def add_records(self, name, keys, values=None, fields=None, texts=None, columns=False):
+        kl = name.lower()
+        if not kl in self.info:
+            raise gdxdict_error("Unknown symbol '%s'" % name)
+        info = self.info[kl]
+        if not "typename" in info:
+            self.set_type(name, "Set" if values is None else "Parameter")
+        typename = info["typename"]
+        dims = info["dims"]
+        if dims == 0:
+            raise gdxdict_error("'%s' has no dimensions" % name)
+        is_set = typename == "Set"
+        has_limits = typename == "Variable" or typename == "Equation"
+        if values is None and not is_set:
+            raise gdxdict_error("%s '%s' needs values" % (typename, name))
+        if fields and not has_limits:
+            raise gdxdict_error("%s '%s' only has levels" % (typename, name))
+        if texts is not None and not is_set:
+            raise gdxdict_error("Only sets have record descriptions, and '%s' is a %s" % (name, typename))
+
+        if columns:
+            key_columns = list(keys)
+        else:
+            rows = list(keys)
+            if dims == 1 and (len(rows) == 0 or isinstance(rows[0], basestring)):
+                key_columns = [rows]
+            else:
+                if set(map(len, rows)) - set([dims]):
+                    raise gdxdict_error("Every record of '%s' needs %d keys" % (name, dims))
+                key_columns = zip(*rows) or [[]] * dims
+        if len(key_columns) != dims:
+            raise gdxdict_error("'%s' has %d dimensions, not %d" % (name, dims, len(key_columns)))
+        count = len(key_columns[0])
+        for c in key_columns[1:] + [values, texts] + (fields or {}).values():
+            if c is not None and len(c) != count:
+                raise gdxdict_error("The keys and values for '%s' have different lengths" % name)
+
+        key_indexes = self.add_keys(key_columns)
+
+        cols = self.columns(kl)
+        was_empty = len(cols) == 0
+
+        removed = {}
+        if is_set:
+            if values is not None:
+                keep = []
+                for p in xrange(count):
+                    r = tuple([k[p] for k in key_indexes])
+                    if values[p]:
+                        keep.append(p)
+                        if r in removed: del removed[r]
+                    else:
+                        removed[r] = True
+                if len(keep) < count:
+                    key_indexes = [array.array("i", [k[p] for p in keep]) for k in key_indexes]
+                    if texts is not None: texts = [texts[p] for p in keep]
+                    count = len(keep)
+            if texts is None:
+                text = array.array("i", [0]) * count
+            else:
+                text = array.array("i", map(cols.add_text, texts))
+            if not was_empty:
+                # Records added again without a description keep the one
+                # they had
+                old = dict(itertools.izip(itertools.izip(*cols.keys), cols.text))
+                for p in xrange(count):
+                    if text[p] == 0:
+                        text[p] = old.get(tuple([k[p] for k in key_indexes]), 0)
+            cols.text.extend(text)
+        elif has_limits:
+            defaults = default_variable_fields[info["userinfo"]]
+            for f in (fields or {}):
+                if not f in level_names:
+                    raise gdxdict_error("Unknown field '%s'" % f)
+            for f in range(len(level_names)):
+                if f == gdxcc.GMS_VAL_LEVEL:
+                    cols.values[f].extend(array.array("d", values))
+                elif fields and level_names[f] in fields:
+                    cols.values[f].extend(array.array("d", fields[level_names[f]]))
+                else:
+                    cols.values[f].extend(array.array("d", [defaults[f]]) * count)
+        else:
+            cols.values[gdxcc.GMS_VAL_LEVEL].extend(array.array("d", values))
+
+        for d in range(dims):
+            cols.keys[d].extend(key_indexes[d])
+        if was_empty:
+            rows = zip(*key_indexes)
+            cols.ordered = rows == sorted(rows) and len(set(rows)) == len(rows)
+        else:
+            cols.ordered = False
+        if removed:
+            cols.sort()
+            cols.remove(removed)
+
+
+# -- Aggregate symbols ---------------------------------------------------------
+
+    # Make a new parameter called result from a field (".l", ".m" and so on) of
+    # symbol name.  keep is a list of the dimensions (counting from 0) of name
+    # to keep, and the other dimensions are aggregated over with how, which
+    # is one of "sum", "count", "min", "max" or "mean".  maps groups kept
+    # dimensions through 2-D mapping sets: with maps={0: "map"}, the keys of
+    # name's first dimension are replaced by the keys they're mapped to in
+    # the second dimension of map, and records with keys that aren't in map
+    # are left out.  Set records all have a value of 1.
+    # The work is done over the symbols' gdxcolumns, with NumPy if it's
+    # installed, and result is added to the gdxdict as a gdxcolumns (which is
+    # returned, or the value, if nothing is kept), so it can be written like
+    # any other symbol.
+    def aggregate(self, name, result, keep, how="sum", maps=None, field=".l", description=""):
+        if not how in aggregators:
+            raise gdxdict_error("Unknown aggregation '%s'" % how)
+        if result in self:
+            raise gdxdict_error("Symbol '%s' already exists" % result)
+        if not maps: maps = {}
+        info = self.getinfo(name)
+        for d in list(keep) + list(maps):
+            if d < 0 or d >= info["dims"]:
+                raise gdxdict_error("'%s' doesn't have a dimension %d" % (name, d))
+        for d in maps:
+            if not d in keep:
+                raise gdxdict_error("Dimension %d of '%s' is mapped, but isn't kept" % (d, name))
+        if not field in level_names:
+            raise gdxdict_error("Unknown field '%s'" % field)
+
+        cols = self.columns(name)
+        cols.sort()
+        if info["typename"] == "Set":
+            values = array.array("d", [1.0]) * len(cols)
+        elif len(cols.values) == len(level_names):
+            values = cols.values[level_names.index(field)]
+        elif field == ".l":
+            values = cols.values[gdxcc.GMS_VAL_LEVEL]
+        else:
+            raise gdxdict_error("%s '%s' doesn't have a '%s' field" % (info["typename"], name, field))
+
+        # Work out the result's domain, and the mapping set for each mapped
+        # dimension
+        domains = []
+        map_sets = []
+        for d in keep:
+            if d in maps:
+                m = self.columns(maps[d])
+                if len(m.keys) != 2:
+                    raise gdxdict_error("Mapping set '%s' should have two dimensions" % maps[d])
+                m.sort()
+                map_sets.append(m)
+                domains.append(self.getinfo(maps[d])["domain"][1]["key"])
+            else:
+                map_sets.append(None)
+                domains.append(info["domain"][d]["key"])
+
+        keys = [cols.keys[d] for d in keep]
+        try:
+            numpy = import_numpy()
+        except gdxdict_error:
+            numpy = None
+        if numpy:
+            result_keys, result_values = aggregate_arrays(numpy, keys, values, map_sets, how)
+        else:
+            result_keys, result_values = aggregate_loop(keys, values, map_sets, how)
+
+        rinfo = {
+          "name": result,
+          "dims": len(keep),
+          "typename": "Parameter",
+          "description": description,
+          "domain": [{ "key": d } for d in domains],
+        }
+        self.add_symbol(rinfo)
+        kl = result.lower()
+        if len(keep) == 0:
+            if len(result_values) > 0:
+                r = result_values[0]
+            else:
+                r = 0.0
+        else:
+            r = gdxcolumns(self, len(keep), "Parameter")
+            r.keys = result_keys
+            r.values[gdxcc.GMS_VAL_LEVEL] = result_values
+        self.symbols[kl] = r
+        guess_ancestor_domains(self)
+        return r
+
+
+# -- Dense arrays --------------------------------------------------------------
+
+    def domain_axis(self, key):
+        # The indexes of the keys in a domain, in universal set order.  The
+        # domain * is the whole universal set.
+        if key == "*": return range(len(self.order))
+        if self.getinfo(key)["dims"] != 1:
+            raise gdxdict_error("Domain '%s' isn't a one-dimensional set" % key)
+        return sorted(set(self.columns(key).keys[0]))
+
+    def dense_axes(self, name):
+        # The keys along each axis of the array to_dense makes for a symbol
+        axes = []
+        for d in self.getinfo(name)["domain"]:
+            axes.append([self.order[i] for i in self.domain_axis(d["key"])])
+        return axes
+
+    # Make a NumPy array of a field of a symbol.  Each axis of the array runs
+    # over the keys of the symbol's domain for that dimension (see dense_axes),
+    # and entries with no record are set to fill.  Records with keys that
+    # aren't in their domains are left out.  If the array would be bigger
+    # than max_bytes (or max_dense_bytes), gdxdict_error is raised instead.
+    def to_dense(self, name, fill=0.0, field=".l", max_bytes=None):
+        numpy = import_numpy()
+        if max_bytes == None: max_bytes = max_dense_bytes
+        if not field in level_names:
+            raise gdxdict_error("Unknown field '%s'" % field)
+        info = self.getinfo(name)
+
+        if info["dims"] == 0:
+            v = self[name]
+            if info["typename"] == "Variable" or info["typename"] == "Equation":
+                v = info.get("limits", {}).get(field, v)
+            return numpy.array(v, dtype=numpy.float64)
+
+        axes = [self.domain_axis(d["key"]) for d in info["domain"]]
+        shape = tuple([len(a) for a in axes])
+        size = numpy.dtype(numpy.float64).itemsize
+        for n in shape: size *= n
+        if size > max_bytes:
+            raise gdxdict_error("A dense copy of '%s' would take %d bytes, more than the limit of %d" % (name, size, max_bytes))
+
+        dense = numpy.empty(shape, dtype=numpy.float64)
+        dense.fill(fill)
+
+        cols = self.sorted_columns(name)
+        if len(cols) == 0: return dense
+        if info["typename"] == "Set":
+            values = numpy.ones(len(cols), dtype=numpy.float64)
+        else:
+            values = numpy.frombuffer(self.field_buffer(name, field), dtype=numpy.float64)
+
+        # Turn each column of key indexes into positions along its axis
+        positions = []
+        inside = numpy.ones(len(cols), dtype=bool)
+        for d in range(len(axes)):
+            lookup = numpy.empty(len(self.order), dtype=numpy.intp)
+            lookup.fill(-1)
+            lookup[numpy.array(axes[d], dtype=numpy.intp)] = numpy.arange(len(axes[d]))
+            p = lookup[numpy.frombuffer(cols.keys[d], dtype=numpy.intc)]
+            inside &= p >= 0
+            positions.append(p)
+        dense[tuple([p[inside] for p in positions])] = values[inside]
+        return dense
+
+    # Load a NumPy array (or anything numpy.asarray accepts) into a parameter.
+    # domains has the name of a one-dimensional set (or * for the universal
+    # set) for each axis, and the array has to be the shape to_dense would make
+    # over those domains.  Entries equal to fill (or NaN, if fill is NaN) don't
+    # become records.  If the symbol already exists, its records are replaced.
+    # The symbol is stored (and returned) as a gdxcolumns, or as its value if
+    # it has no dimensions.
+    def from_dense(self, name, dense, domains, fill=0.0, description=""):
+        numpy = import_numpy()
+        dense = numpy.asarray(dense, dtype=numpy.float64)
+        if dense.ndim != len(domains):
+            raise gdxdict_error("An array with %d dimensions can't go in a symbol over %d domains" % (dense.ndim, len(domains)))
+        axes = [numpy.array(self.domain_axis(d), dtype=numpy.intc) for d in domains]
+        shape = tuple([len(a) for a in axes])
+        if dense.shape != shape:
+            raise gdxdict_error("The array's shape %s doesn't match the domains' shape %s" % (dense.shape, shape))
+
+        self.add_symbol({
+          "name": name,
+          "dims": len(domains),
+          "typename": "Parameter",
+          "description": description,
+          "domain": [{ "key": d } for d in domains],
+        })
+
+        if len(domains) == 0:
+            cols = float(dense)
+        else:
+            if fill != fill:
+                positions = numpy.nonzero(~numpy.isnan(dense))
+            else:
+                positions = numpy.nonzero(dense != fill)
+            # nonzero gives positions in row-major order, and each axis is in
+            # universal set order, so the records are already in order
+            cols = gdxcolumns(self, len(domains), "Parameter")
+            for d in range(len(domains)):
+                cols.keys[d].fromstring(axes[d][positions[d]].tostring())
+            cols.values[gdxcc.GMS_VAL_LEVEL].fromstring(dense[positions].tostring())
+        self[name] = cols
+        guess_ancestor_domains(self)
+        return cols
+
+
+# -- Buffers -------------------------------------------------------------------
+
+    # These hand out the arrays behind a symbol, for code that wants to read a
+    # big symbol without copying it.  The symbol is stored as a gdxcolumns in
+    # universal set order, and the arrays are its own storage: an array("i")
+    # of universal set indexes for each dimension (self.order[i] is the key)
+    # and an array("d") for each field.  Both support the buffer protocol, so
+    # numpy.frombuffer or a C extension can use them where they are.  They're
+    # only good until the symbol is changed or stored another way.
+
+    def sorted_columns(self, name):
+        if self.getinfo(name)["dims"] == 0:
+            raise gdxdict_error("'%s' has no dimensions" % name)
+        cols = self.columns(name)
+        cols.sort()
+        return cols
+
+    def key_buffer(self, name, d):
+        # The universal set indexes of dimension d of a symbol's records
+        return self.sorted_columns(name).keys[d]
+
+    def field_buffer(self, name, field=".l"):
+        # One field of a symbol's records.  Parameters only have levels, and
+        # sets have no fields at all.
+        if not field in level_names:
+            raise gdxdict_error("Unknown field '%s'" % field)
+        cols = self.sorted_columns(name)
+        if len(cols.values) == len(level_names):
+            return cols.values[level_names.index(field)]
+        if len(cols.values) > 0 and field == ".l":
+            return cols.values[gdxcc.GMS_VAL_LEVEL]
+        raise gdxdict_error("%s '%s' doesn't have a '%s' field" % (cols.typename, name, field))
+
+    def buffers(self, name):
+        # All of a symbol's arrays: a list of key buffers under "keys", and
+        # each field the symbol has under its name in level_names
+        cols = self.sorted_columns(name)
+        result = { "keys": list(cols.keys) }
+        if len(cols.values) == len(level_names):
+            for i in range(len(level_names)):
+                result[level_names[i]] = cols.values[i]
+        elif len(cols.values) > 0:
+            result[".l"] = cols.values[gdxcc.GMS_VAL_LEVEL]
+        return result
+
+
 #- Write a GDX file ------------------------------------------------------------
 
     def write(self, filename, gams_dir=None):
+        # Guess domains before we go through the symbols, because the order
+        # they're written in depends on their domains
+        for kl in list(self.pending):
+            if self.info[kl]["dims"] > 0 and self.unloaded(kl):
+                self.guess_pending_domains(kl)
+        guess_ancestor_domains(self)
+
+        # If we're going to copy symbols from a file we're about to write
+        # over, write somewhere else first
+        output = filename
+        for f in self.files:
+            if os.path.abspath(f["filename"]) == os.path.abspath(filename):
+                output = filename + ".tmp"
+
         H = gdxx.open(gams_dir)
-        assert gdxcc.gdxOpenWrite(H, filename, "gdxdict.py")[0], "Couldn't open %s" % filename
+        assert gdxcc.gdxOpenWrite(H, output, "gdxdict.py")[0], "Couldn't open %s" % output
 
         # write the universal set
         gdxcc.gdxUELRegisterRawStart(H)
@@ -437,28 +2348,117 @@ class gdxdict:
             gdxcc.gdxUELRegisterRaw(H, self.order[i])
         gdxcc.gdxUELRegisterDone(H)
 
+        # Set texts we've written, and their numbers
+        texts = {}
+
         for k in self:
-            symbol = self[k]
+            kl = k.lower()
             info = self.getinfo(k)
+            stream = info["dims"] > 0 and self.unloaded(kl)
+            if not stream: self.load(kl)
+            symbol = self.symbols[kl]
+            if isinstance(symbol, gdxflat): symbol = symbol.columns()
             if info["dims"] == 0:
                 if not gdxcc.gdxDataWriteStrStart(H, k, info["description"], 0, get_type_code(info["typename"]), info["userinfo"]):
                     raise gdxx.GDX_error(H, "couldn't start writing data")
                 set_symbol(H, self, k, info["typename"], info["userinfo"], values, [])
                 gdxcc.gdxDataWriteDone(H)
             else:
-                if not gdxcc.gdxDataWriteStrStart(H, k, info["description"], info["dims"], get_type_code(info["typename"]), info["userinfo"]):
+                if not gdxcc.gdxDataWriteRawStart(H, k, info["description"], info["dims"], get_type_code(info["typename"]), info["userinfo"]):
                     raise gdxx.GDX_error(H, "couldn't start writing data")
                 domain = []
                 for d in info["domain"]:
                     domain.append(d["key"])
                 if gdxcc.gdxSymbolSetDomain(H, domain) != 1:
                     raise gdxx.GDX_error(H, "couldn't set domain for symbol %s to %s" % (k, domain))
-                write_symbol(H, info["typename"], info["userinfo"], symbol, [])
+                if stream:
+                    self.write_pending(H, kl, texts)
+                elif isinstance(symbol, gdxcolumns):
+                    write_columns(H, symbol, texts)
+                else:
+                    write_raw_symbol(H, symbol, info["dims"], info["typename"], info["userinfo"], texts)
                 gdxcc.gdxDataWriteDone(H)
 
         gdxcc.gdxClose(H)
         gdxcc.gdxFree(H)
 
+        if output != filename:
+            self.close()
+            os.remove(filename)
+            os.rename(output, filename)
+
+
+    # Symbols in lazily-read files that haven't been loaded at all don't need
+    # to be loaded to be written: their records can be copied across from the
+    # files they're in, one record at a time
+
+    def unloaded(self, kl):
+        if not kl in self.pending: return False
+        s = self.symbols[kl]
+        if isinstance(s, gdxdim): return len(s.items) == 0
+        if isinstance(s, gdxcolumns) or isinstance(s, gdxflat): return len(s) == 0
+        return False
+
+
+    def pending_records(self, f, num, n):
+        # The records of symbol num in file f as (keys, n, values, text), where
+        # keys are indexes into our universal set.  A GDX handle can only read
+        # one symbol at a time, so if another stream is part way through
+        # reading from the file, we read from a handle of our own.
+        umap = f["umap"]
+        own = f.get("streaming")
+        if own:
+            H = self.lazy_open(f)
+            texts = gdxx.elem_text_cache(H)
+        else:
+            H = self.lazy_handle(f)
+            texts = f["texts"]
+            f["streaming"] = True
+        try:
+            for elements, record_values in gdxx.iter_records(H, num, "raw"):
+                keys = []
+                for e in elements: keys.append(umap[e])
+                text = texts.get(record_values[gdxcc.GMS_VAL_LEVEL])
+                yield tuple(keys), n, record_values, text
+        finally:
+            if own:
+                gdxcc.gdxClose(H)
+                gdxcc.gdxFree(H)
+            else:
+                f["streaming"] = False
+
+
+    def pending_stream(self, kl):
+        # Merge the records from all the files the symbol is in.  Each file
+        # gives us its records in order (or we sort them if its UELs aren't in
+        # the same order as ours), and if the same record is in more than one
+        # file, the last file read wins, as it does when the records are
+        # loaded.
+        streams = []
+        for n, (f, num, sinfo) in enumerate(self.pending[kl]):
+            stream = self.pending_records(f, num, n)
+            if not f["ordered"]: stream = sorted(stream)
+            streams.append(stream)
+
+        last = None
+        for record in heapq.merge(*streams):
+            if last and last[0] != record[0]: yield last
+            last = record
+        if last: yield last
+
+
+    def write_pending(self, H, kl, texts):
+        is_set = self.info[kl]["typename"] == "Set"
+        for keys, n, record_values, text in self.pending_stream(kl):
+            for i in range(gdxcc.GMS_VAL_MAX):
+                values[i] = record_values[i]
+            if is_set:
+                text_index = 0
+                if text != None: text_index = add_set_text(H, texts, text)
+                values[gdxcc.GMS_VAL_LEVEL] = float(text_index)
+            if not gdxcc.gdxDataWriteRaw(H, [k + 1 for k in keys], values):
+                raise gdxx.GDX_error(H, "Error in gdxDataWriteRaw")
+
 
 #- UEL Handling ----------------------------------------------------------------
 
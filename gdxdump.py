@@ -15,6 +15,7 @@ def dump_GDX_file(H, filename):
     assert gdxcc.gdxOpenRead(H, filename)[0], "Couldn't open %s" % filename
 
     info = gdxx.file_info(H)
+    texts = gdxx.elem_text_cache(H)
     print "*  File Version   : %s" % info["version"]
     print "*  Producer       : %s" % info["producer"]
     print "*  Symbols        : %d" % info["symbol_count"]
@@ -32,20 +33,15 @@ def dump_GDX_file(H, filename):
         dim_string = ""
         if sinfo["dims"] > 0:
             dim_string = "("
-            for j in sinfo["domain"]:
-                if j["index"] > 0: dim_string += ","
-                d = sinfo["domain"][j["index"]]
-                dim_string += d["key"]
+            for j in range(sinfo["dims"]):
+                if j > 0: dim_string += ","
+                dim_string += sinfo["domain"][j]["key"]
             dim_string += ")"
         desc = sinfo["description"]
         sm = '"' if "'" in desc else "'"
         print "%s%s %s%s%s /" % (name, dim_string, sm, desc, sm)
         
-        ok, records = gdxcc.gdxDataReadStrStart(H, i)
-        
-        for i in range(records):
-            ok, elements, values, afdim = gdxcc.gdxDataReadStr(H)
-            if not ok: raise GDX_error(H, "Error in gdxDataReadStr")
+        for elements, values in gdxx.iter_records(H, i):
             if values[gdxcc.GMS_VAL_LEVEL] == 0: continue
             dim_string = ""
             for d in range(sinfo["dims"]):
@@ -56,8 +52,8 @@ def dump_GDX_file(H, filename):
             if sinfo["type"] == gdxcc.GMS_DT_PAR or sinfo["type"] == gdxcc.GMS_DT_VAR:
                 value_string = "%g" % values[gdxcc.GMS_VAL_LEVEL]
             if sinfo["type"] == gdxcc.GMS_DT_SET:
-                ret, description, node =  gdxcc.gdxGetElemText(H, int(values[gdxcc.GMS_VAL_LEVEL]))
-                if ret != 0:
+                description = texts.get(values[gdxcc.GMS_VAL_LEVEL])
+                if description != None:
                     sm = '"' if "'" in description else "'"
                     value_string = "%s%s%s" % (sm, description, sm)
             print "%s %s" % (dim_string, value_string)
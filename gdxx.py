@@ -5,6 +5,7 @@ import gdxcc
 import sys
 import os
 import re
+import array
 
 
 #- Errors ----------------------------------------------------------------------
@@ -122,5 +123,120 @@ def symbol_info(H, num):
      }
 
 
+#- Reading records -------------------------------------------------------------
+
+# Iterate over the records of a symbol (given by number or name).
+#
+# In "str" mode each record is (elements, values) where elements is a list of
+# UEL strings, and in "raw" mode, elements is a list of raw UEL numbers.
+# values is a list of all GMS_VAL_MAX values for the record, or, if fields is
+# given, just the values at those indexes (eg [gdxcc.GMS_VAL_LEVEL]).
+#
+# If batch is given, the records come in batches of up to that many: each
+# batch is (keys, values) where keys has a column for each dimension (an
+# array("i") of UEL numbers in raw mode, a list of strings in str mode) and
+# values has an array("d") for each field.
+#
+# gdxDataReadDone is called when the iteration finishes, even if the caller
+# stops early.
+
+def iter_records(H, symbol, mode="str", fields=None, batch=None):
+    if batch:
+        return iter_record_batches(H, symbol, mode, fields, batch)
+    else:
+        return iter_record_list(H, symbol, mode, fields)
+
+
+def start_read(H, symbol, mode):
+    if type(symbol) == str:
+        ret, num = gdxcc.gdxFindSymbol(H, symbol)
+        if not ret: raise GDX_error(H, "Couldn't find symbol '%s'" % symbol)
+    else:
+        num = symbol
+
+    if mode == "raw":
+        ret, records = gdxcc.gdxDataReadRawStart(H, num)
+        read = gdxcc.gdxDataReadRaw
+    elif mode == "str":
+        ret, records = gdxcc.gdxDataReadStrStart(H, num)
+        read = gdxcc.gdxDataReadStr
+    else:
+        raise GDX_error(None, "Unknown read mode '%s'" % mode)
+    if not ret: raise GDX_error(H, "Couldn't start reading symbol %s" % symbol)
+    return read, records
+
+
+def iter_record_list(H, symbol, mode, fields):
+    read, records = start_read(H, symbol, mode)
+    try:
+        for i in xrange(records):
+            ret, elements, values, afdim = read(H)
+            if not ret: raise GDX_error(H, "Couldn't read a record of symbol %s" % symbol)
+            if fields:
+                values = [values[f] for f in fields]
+            yield elements, values
+    finally:
+        gdxcc.gdxDataReadDone(H)
+
+
+def iter_record_batches(H, symbol, mode, fields, size):
+    if not fields: fields = range(gdxcc.GMS_VAL_MAX)
+    def new_batch(dims):
+        keys = []
+        for d in range(dims):
+            if mode == "raw":
+                keys.append(array.array("i"))
+            else:
+                keys.append([])
+        values = []
+        for f in fields:
+            values.append(array.array("d"))
+        return keys, values
+
+    batch = None
+    count = 0
+    for elements, record_values in iter_record_list(H, symbol, mode, fields):
+        if not batch:
+            batch = new_batch(len(elements))
+        keys, values = batch
+        for d in range(len(keys)):
+            keys[d].append(elements[d])
+        for f in range(len(values)):
+            values[f].append(record_values[f])
+        count += 1
+        if count == size:
+            yield batch
+            batch = None
+            count = 0
+    if batch:
+        yield batch
+
+
+#- Element text ----------------------------------------------------------------
+
+# Set records (and UELs) store the number of their text, and lots of records
+# share the same text or have none at all, so rather than calling
+# gdxGetElemText for every record, remember the texts we've already looked up
+# for a handle.  Text number 0 means "no text", and gives None.
+# The cache is emptied if it gets to size texts.
+
+class elem_text_cache:
+
+    def __init__(self, H, size=100000):
+        self.H = H
+        self.size = size
+        self.texts = {}
+
+    def get(self, number):
+        number = int(number)
+        if number == 0: return None
+        if number in self.texts: return self.texts[number]
+        ret, text, node = gdxcc.gdxGetElemText(self.H, number)
+        if ret == 0: text = None
+        if len(self.texts) >= self.size: self.texts.clear()
+        self.texts[number] = text
+        return text
+
+
 #- EOF -------------------------------------------------------------------------
 
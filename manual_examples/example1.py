@@ -1,4 +1,5 @@
 from gdxcc import *
+import gdxx
 import sys
 import os
 
@@ -43,21 +44,16 @@ else:
     ret, symName, dim, symType = gdxSymbolInfo(gdxHandle, symNr)
     assert dim == 2 and symType == GMS_DT_VAR, "**** x is not a two dimensional variable:\n" + "dim = " + str(dim) + "\nvarTyp = " + str(symType)
         
-    ret, nrRecs =  gdxDataReadStrStart(gdxHandle, symNr)
-    assert ret, "Error in gdxDataReadStrStart: "+gdxErrorStr(gdxHandle,gdxGetLastError(gdxHandle))[1]
-        
+    ret, nrRecs, userInfo, description = gdxSymbolInfoX(gdxHandle, symNr)
     print "Variable x has", nrRecs, "records"
-    for i in range(nrRecs):
-        ret, elements, values, afdim = gdxDataReadStr(gdxHandle)
-        assert ret, "Error in gdxDataReadStr: "+gdxErrorStr(gdxHandle,gdxGetLastError(gdxHandle))[1]
-        if 0 == values[GMS_VAL_LEVEL]: continue
+    for elements, values in gdxx.iter_records(gdxHandle, symNr, fields=[GMS_VAL_LEVEL]):
+        if 0 == values[0]: continue
         for d in range(dim):
             print elements[d],
             if d < dim-1:
                 print ".",
-        print " =", values[GMS_VAL_LEVEL]
+        print " =", values[0]
     print "All solution values shown"
-    gdxDataReadDone(gdxHandle)
     
 assert not gdxClose(gdxHandle)
 assert gdxFree(gdxHandle)